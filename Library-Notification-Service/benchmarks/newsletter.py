@@ -0,0 +1,183 @@
+"""Run the newsletter commands end to end against the local stub server.
+
+The stub server runs in a child process. Every run reports the requests
+issued and the bytes exchanged per endpoint, the wall time and the peak
+memory allocated by Python (tracemalloc). With `--baseline`, the median run
+is compared to a previous `--output`, failing on more requests or bytes, or
+on wall time/memory over the tolerance.
+
+    python -m benchmarks.newsletter --documents 5000 --items 8000 --latency 0.01
+    python -m benchmarks.newsletter --config newsletters.example.json --output run.json
+"""
+
+import json
+import os
+import statistics
+import time
+import tracemalloc
+from typing import List, Optional
+
+import click
+from click.testing import CliRunner
+
+from .strategies import BENCHMARK_ENV
+from .stub_server import StubServerProcess, generate_week
+
+METRICS = ("requests", "sent_bytes", "received_bytes", "seconds", "peak_bytes")
+
+# metrics which must not grow at all, the others are noisy
+EXACT_METRICS = ("requests", "sent_bytes", "received_bytes")
+
+
+def run_newsletter(server, args: List[str]) -> dict:
+    """Run `python -m src.cli <args>` in-process against `server` once.
+
+    `server` is a `StubServer` or a `StubServerProcess`, the environment
+    must already point at it (see their `get_env`).
+    """
+    from src import client
+    from src.cli import main
+    from src.env import settings
+
+    settings.reset()
+    client.close_session()
+    server.reset()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = CliRunner().invoke(main, args)
+    seconds = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    client.close_session()
+
+    if result.exit_code != 0:
+        raise click.ClickException(
+            f"{' '.join(args)} failed ({result.exit_code}): {result.output}"
+        )
+
+    stats = server.stats()
+    return {
+        "requests": sum(stats["requests"].values()),
+        "sent_bytes": sum(stats["sent_bytes"].values()),
+        "received_bytes": sum(stats["received_bytes"].values()),
+        "seconds": seconds,
+        "peak_bytes": peak_bytes,
+        "endpoints": stats["requests"],
+        "notifications": stats["notifications"],
+    }
+
+
+def get_median_run(runs: List[dict]) -> dict:
+    return {
+        metric: statistics.median(run[metric] for run in runs) for metric in METRICS
+    }
+
+
+def get_regressions(median: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    for metric in METRICS:
+        limit = baseline[metric]
+        if metric not in EXACT_METRICS:
+            limit *= 1 + tolerance
+        if median[metric] > limit:
+            regressions.append(
+                f"{metric}: {median[metric]:.6g} > {baseline[metric]:.6g}"
+            )
+    return regressions
+
+
+@click.command()
+@click.option("--documents", type=int, default=1200, show_default=True)
+@click.option("--items", type=int, default=1500, show_default=True)
+@click.option("--eitems", type=int, default=400, show_default=True)
+@click.option(
+    "--recent",
+    type=float,
+    default=0.3,
+    show_default=True,
+    help="Share of the documents created in the week.",
+)
+@click.option(
+    "--abstract-bytes",
+    type=int,
+    default=2000,
+    show_default=True,
+    help="Size of the unused fields of every literature record.",
+)
+@click.option("--latency", type=float, default=0.0, show_default=True)
+@click.option("--runs", type=int, default=3, show_default=True)
+@click.option("--strategy", type=click.Choice(["pids", "pushdown"]), default="pids")
+@click.option("--subjects", multiple=True, default=["53*:"], show_default=True)
+@click.option(
+    "--config",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Run newsletter-batch with this config instead of newsletter.",
+)
+@click.option("--output", type=click.Path(dir_okay=False, writable=True))
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--tolerance",
+    type=float,
+    default=0.5,
+    show_default=True,
+    help="Allowed wall time and memory increase over --baseline.",
+)
+def main(
+    documents: int,
+    items: int,
+    eitems: int,
+    recent: float,
+    abstract_bytes: int,
+    latency: float,
+    runs: int,
+    strategy: str,
+    subjects: List[str],
+    config: Optional[str],
+    output: Optional[str],
+    baseline: Optional[str],
+    tolerance: float,
+) -> None:
+    if config:
+        args = ["newsletter-batch", "--config", config]
+    else:
+        args = ["newsletter", "--title", "Benchmark", "--target", "benchmark"]
+        args += [
+            argument for subject in subjects for argument in ("--subjects", subject)
+        ]
+    args += ["--strategy", strategy, "--no-cache"]
+
+    week = generate_week(
+        documents, items, eitems, recent, abstract_bytes=abstract_bytes
+    )
+    with StubServerProcess(week, latency) as server:
+        os.environ.update({**BENCHMARK_ENV, **server.get_env()})
+        results = [run_newsletter(server, args) for _ in range(runs)]
+
+    click.echo(f"{'run':>3} {'requests':>8} {'sent':>10} {'received':>10} ", nl=False)
+    click.echo(f"{'seconds':>8} {'peak MB':>8} notifications")
+    for index, run in enumerate(results, 1):
+        click.echo(
+            f"{index:>3} {run['requests']:>8} {run['sent_bytes']:>10} "
+            f"{run['received_bytes']:>10} {run['seconds']:>8.2f} "
+            f"{run['peak_bytes'] / 2**20:>8.1f} {run['notifications']}"
+        )
+    click.echo(f"endpoints: {results[0]['endpoints']}")
+
+    median = get_median_run(results)
+    if output:
+        with open(output, "w") as output_file:
+            json.dump({"args": args, "median": median, "runs": results}, output_file)
+
+    if baseline:
+        with open(baseline) as baseline_file:
+            regressions = get_regressions(
+                median, json.load(baseline_file)["median"], tolerance
+            )
+        if regressions:
+            raise click.ClickException("Regressions: " + ", ".join(regressions))
+        click.echo(f"No regression over {baseline}.")
+
+
+if __name__ == "__main__":
+    main()
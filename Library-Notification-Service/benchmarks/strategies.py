@@ -0,0 +1,171 @@
+"""Compare the pids and pushdown newsletter strategies on a synthetic week.
+
+The catalogue is served in-process from the generated `data/week.json`: the
+PIDs of the items/eitems created that week and the catalogue documents,
+flagged `recent` when created or updated that week. Every request waits
+`--latency` seconds to stand in for the network.
+
+    python -m benchmarks.strategies --latency 0.05
+"""
+
+import json
+import os
+import re
+import time
+import urllib.parse
+from fnmatch import fnmatch
+
+import click
+from requests import Response
+from requests.adapters import BaseAdapter
+
+BENCHMARK_ENV = {
+    "MAX_NOTIFICATION_RESULTS_COUNT": "20",
+    "LIBRARY_CATALOGUE_SITE_API": "https://catalogue.local/api/literature/?q=",
+    "LIBRARY_CATALOGUE_SITE_URL": "https://catalogue.local/search?q=",
+    "LIBRARY_CATALOGUE_BACKOFFICE_ITEMS_API": "https://catalogue.local/api/items/?q=",
+    "LIBRARY_CATALOGUE_BACKOFFICE_EITEMS_API": "https://catalogue.local/api/eitems/?q=",
+    "LIBRARY_CATALOGUE_BACKOFFICE_API_TOKEN": "benchmark",
+    "NOTIFICATIONS_API_URL": "https://notifications.local/api/notifications",
+    "NOTIFICATIONS_API_SECRET": "benchmark",
+    "NOTIFICATIONS_CHANNEL_ID": "benchmark",
+}
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+DEFAULT_PAGE_SIZE = 10
+
+
+def matches_subjects(document: dict, subject_filters: list) -> bool:
+    """Subjects filter of the catalogue, subjects are flattened like in the index."""
+    values = [subject["value"] for subject in document["subjects"]]
+    schemes = [subject["scheme"] for subject in document["subjects"]]
+    return any(
+        any(fnmatch(value, pattern) for value in values)
+        and (not scheme or scheme in schemes)
+        for pattern, scheme in subject_filters
+    )
+
+
+class RecordedCatalogue(BaseAdapter):
+    """Transport adapter answering the catalogue queries from a synthetic week."""
+
+    def __init__(self, data: dict, latency: float = 0.0) -> None:
+        super().__init__()
+        self.documents = {document["pid"]: document for document in data["documents"]}
+        self.items = data["items"]
+        self.eitems = data["eitems"]
+        self.latency = latency
+        self.requests = 0
+
+    def paginate(self, url: str, params: dict, hits: list) -> dict:
+        size = int(params.get("size", DEFAULT_PAGE_SIZE))
+        page = int(params.get("page", 1))
+        links = {}
+        if page * size < len(hits):
+            next_params = {**params, "size": size, "page": page + 1}
+            links["next"] = f"{url}?{urllib.parse.urlencode(next_params)}"
+        page_hits = hits[(page - 1) * size : page * size]
+        return {"hits": {"hits": page_hits, "total": len(hits)}, "links": links}
+
+    def search(self, query: str) -> list:
+        documents = self.documents.values()
+        if pids := re.findall(r"pid: ([^\s)]+)", query):
+            documents = [self.documents[pid] for pid in pids if pid in self.documents]
+        elif "_created:" in query:
+            documents = [document for document in documents if document["recent"]]
+
+        subject_filters = re.findall(
+            r"subjects\.value:([^\s)]+)(?: AND subjects\.scheme:([^\s)]+))?", query
+        )
+        if subject_filters:
+            documents = [
+                document
+                for document in documents
+                if matches_subjects(document, subject_filters)
+            ]
+
+        return [
+            {
+                "id": document["pid"],
+                "created": document.get("created"),
+                "metadata": {
+                    "pid": document["pid"],
+                    "title": document["title"],
+                    "subjects": document["subjects"],
+                    **document.get("extra_metadata", {}),
+                },
+            }
+            for document in documents
+        ]
+
+    def send(self, request, **kwargs):
+        self.requests += 1
+        time.sleep(self.latency)
+
+        parsed = urllib.parse.urlsplit(request.url)
+        url = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        if parsed.path.endswith("/items/") or parsed.path.endswith("/eitems/"):
+            pids = self.items if parsed.path.endswith("/items/") else self.eitems
+            hits = [{"metadata": {"document_pid": pid}} for pid in pids]
+        else:
+            hits = self.search(params.get("q", ""))
+
+        response = Response()
+        response.status_code = 200
+        response.url = request.url
+        response.request = request
+        response._content = json.dumps(self.paginate(url, params, hits)).encode()
+        return response
+
+    def close(self):
+        pass
+
+
+def run_strategy(strategy: str, subjects: list) -> list:
+    from src.api import (
+        iter_backoffice_latest_pids,
+        iter_latest_subject_docs,
+        iter_results_from_pids,
+    )
+
+    if strategy == "pushdown":
+        return list(iter_latest_subject_docs(subjects))
+    return list(iter_results_from_pids(iter_backoffice_latest_pids(), subjects))
+
+
+@click.command()
+@click.option("--data", default=os.path.join(DATA_DIR, "week.json"))
+@click.option("--newsletters", default="newsletters.example.json")
+@click.option("--latency", type=float, default=0.05, show_default=True)
+def main(data: str, newsletters: str, latency: float) -> None:
+    for env_name, env_value in BENCHMARK_ENV.items():
+        os.environ.setdefault(env_name, env_value)
+    from src import client
+
+    with open(data) as data_file:
+        recorded = json.load(data_file)
+    with open(newsletters) as newsletters_file:
+        configs = json.load(newsletters_file)["newsletters"]
+
+    click.echo(f"{'subjects':<40} {'strategy':<9} {'requests':>8} {'seconds':>8} docs")
+    for config in configs:
+        for strategy in ("pids", "pushdown"):
+            adapter = RecordedCatalogue(recorded, latency)
+            session = client.create_session()
+            session.mount("https://", adapter)
+            client._session = session
+
+            start = time.perf_counter()
+            documents = run_strategy(strategy, config["subjects"])
+            elapsed = time.perf_counter() - start
+
+            subjects = " ".join(config["subjects"])
+            click.echo(
+                f"{subjects:<40} {strategy:<9} {adapter.requests:>8} "
+                f"{elapsed:>8.2f} {len(documents)}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""Local HTTP server standing in for the catalogue and the notifications API.
+
+The backoffice items/eitems, the literature search and the notifications
+endpoint are served from a synthetic week (same shape as `data/week.json`)
+of any volume, every response delayed by `latency` seconds. The server
+counts the requests and the bytes exchanged per endpoint, reported on
+`GET /_stats` and reset on `POST /_reset`.
+"""
+
+import json
+import multiprocessing
+import random
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+from collections.abc import Sequence
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .strategies import RecordedCatalogue
+
+# (value, scheme) subjects covering every newsletter in newsletters.example.json,
+# and a few matching none of them
+SUBJECTS = [
+    ("004.4", "UDC"),
+    ("005.1", "UDC"),
+    ("005.1", "DEWEY"),
+    ("006.3", "UDC"),
+    ("007.5", "UDC"),
+    ("51-7", "UDC"),
+    ("519.2", "UDC"),
+    ("52-6", "UDC"),
+    ("53.01", "UDC"),
+    ("539.1", "UDC"),
+    ("621.3", "UDC"),
+    ("65.01", "UDC"),
+    ("658.5", "UDC"),
+    ("81'1", "UDC"),
+    ("94(4)", "UDC"),
+]
+
+
+def get_env(url: str) -> dict:
+    """Environment variables pointing the service at the stub server `url`."""
+    return {
+        "LIBRARY_CATALOGUE_SITE_API": f"{url}/api/literature/?q=",
+        "LIBRARY_CATALOGUE_SITE_URL": f"{url}/search?q=",
+        "LIBRARY_CATALOGUE_BACKOFFICE_ITEMS_API": f"{url}/api/items/?q=",
+        "LIBRARY_CATALOGUE_BACKOFFICE_EITEMS_API": f"{url}/api/eitems/?q=",
+        "NOTIFICATIONS_API_URL": f"{url}/api/notifications",
+    }
+
+
+def generate_week(
+    documents: int = 1200,
+    items: int = 1500,
+    eitems: int = 400,
+    recent: float = 0.3,
+    seed: int = 0,
+    abstract_bytes: int = 0,
+) -> dict:
+    """Generate a week of `documents`, a `recent` share created that week.
+
+    The backoffice `items` and `eitems` point to random documents, so the
+    same document PID is listed several times, like in production. Every
+    document gets `abstract_bytes` of abstract and authors, standing in for
+    the fields of the literature records the service does not use.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    generated = []
+    for index in range(documents):
+        is_recent = rng.random() < recent
+        days_ago = rng.randint(0, 6) if is_recent else rng.randint(7, 3650)
+        generated.append(
+            {
+                "pid": str(100000 + index),
+                "title": f"Document {100000 + index}",
+                "subjects": [
+                    {"value": value, "scheme": scheme}
+                    for value, scheme in rng.sample(SUBJECTS, rng.randint(1, 3))
+                ],
+                "created": (today - timedelta(days=days_ago)).isoformat(),
+                "recent": is_recent,
+            }
+        )
+        if abstract_bytes:
+            generated[-1]["extra_metadata"] = {
+                "abstract": "x" * abstract_bytes,
+                "authors": [{"full_name": f"Author {n}"} for n in range(10)],
+            }
+
+    pids = [document["pid"] for document in generated]
+    return {
+        "items": [rng.choice(pids) for _ in range(items)] if pids else [],
+        "eitems": [rng.choice(pids) for _ in range(eitems)] if pids else [],
+        "documents": generated,
+    }
+
+
+class BackofficeHits(Sequence):
+    """Backoffice hits of `pids`, only built for the page served."""
+
+    def __init__(self, pids: list) -> None:
+        self.pids = pids
+
+    def __len__(self) -> int:
+        return len(self.pids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [{"metadata": {"document_pid": pid}} for pid in self.pids[index]]
+        return {"metadata": {"document_pid": self.pids[index]}}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, do not let the body wait for
+    # the ACK of the headers on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path == "/_stats":
+            return self.respond(None, 200, self.server.stats())
+
+        parsed = urllib.parse.urlsplit(self.path)
+        url = f"http://{self.headers['Host']}{parsed.path}"
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        catalogue = self.server.catalogue
+
+        if parsed.path.endswith("/items/") or parsed.path.endswith("/eitems/"):
+            pids = (
+                catalogue.items if parsed.path.endswith("/items/") else catalogue.eitems
+            )
+            hits = BackofficeHits(pids)
+            endpoint = parsed.path.rstrip("/").rsplit("/", 1)[-1]
+        elif parsed.path.endswith("/literature/"):
+            hits = catalogue.search(params.get("q", ""))
+            endpoint = "literature"
+        else:
+            return self.respond("unknown", 404, {})
+
+        self.respond(endpoint, 200, catalogue.paginate(url, params, hits))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/_reset":
+            self.server.reset()
+            return self.respond(None, 200, {})
+        if not self.path.endswith("/notifications"):
+            return self.respond("unknown", 404, {}, len(body))
+
+        with self.server.lock:
+            self.server.notifications.append(json.loads(body))
+        self.respond("notifications", 200, {}, len(body))
+
+    def respond(self, endpoint: str, status: int, body: dict, received: int = 0):
+        if endpoint:
+            self.server.wait()
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        if endpoint:
+            self.server.record(endpoint, len(self.requestline) + received, len(content))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """Serve `week` on a free local port, in a background thread.
+
+    `requests`, `sent_bytes` and `received_bytes` are counted per endpoint
+    from the client side: the request line and body sent, the response
+    body received.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, week: dict, latency: float = 0.0) -> None:
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.catalogue = RecordedCatalogue(week)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.reset()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def get_env(self) -> dict:
+        return get_env(self.url)
+
+    def wait(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def record(self, endpoint: str, sent: int, received: int) -> None:
+        with self.lock:
+            self.requests[endpoint] += 1
+            self.sent_bytes[endpoint] += sent
+            self.received_bytes[endpoint] += received
+
+    def reset(self) -> None:
+        with self.lock:
+            self.requests = Counter()
+            self.sent_bytes = Counter()
+            self.received_bytes = Counter()
+            self.notifications = []
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "sent_bytes": dict(self.sent_bytes),
+                "received_bytes": dict(self.received_bytes),
+                "notifications": len(self.notifications),
+            }
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+def _serve(week: dict, latency: float, connection) -> None:
+    with StubServer(week, latency) as server:
+        connection.send(server.url)
+        connection.recv()
+
+
+class StubServerProcess:
+    """`StubServer` run in a child process, so that its work does not weigh
+    on the timings and memory of the benchmarked process.
+    """
+
+    def __init__(self, week: dict, latency: float = 0.0) -> None:
+        self.week = week
+        self.latency = latency
+        self.url = None
+        self._connection = None
+        self._process = None
+
+    def get_env(self) -> dict:
+        return get_env(self.url)
+
+    def _call(self, method: str, path: str) -> dict:
+        request = urllib.request.Request(f"{self.url}{path}", method=method)
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+
+    def reset(self) -> None:
+        self._call("POST", "/_reset")
+
+    def stats(self) -> dict:
+        return self._call("GET", "/_stats")
+
+    def __enter__(self):
+        self._connection, child_connection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_serve,
+            args=(self.week, self.latency, child_connection),
+            daemon=True,
+        )
+        self._process.start()
+        self.url = self._connection.recv()
+        return self
+
+    def __exit__(self, *args):
+        self._connection.send(None)
+        self._process.join()
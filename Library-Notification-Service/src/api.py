@@ -1,112 +1,310 @@
 """Module interacting with library catalogue api"""
 
 import json
+import queue
 import urllib.parse
-from typing import List
-
-import requests
-
-from .env import (
-    LIBRARY_CATALOGUE_BACKOFFICE_API_TOKEN,
-    LIBRARY_CATALOGUE_BACKOFFICE_EITEMS_API,
-    LIBRARY_CATALOGUE_BACKOFFICE_ITEMS_API,
-    LIBRARY_CATALOGUE_SITE_API,
-    LIBRARY_CATALOGUE_SITE_URL,
-    NOTIFICATIONS_API_SECRET,
-    NOTIFICATIONS_API_URL,
-    NOTIFICATIONS_CHANNEL_ID,
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from .client import RequestError, get_json, get_session
+from .deadline import get_timeout, submit
+from .env import settings
+from .metrics import get_metrics, increment, timed_stage
+from .utils import (
+    get_full_query,
+    get_last_week_date_range,
+    get_latest_subject_query,
+    get_pids_from_docs,
+    iter_unique,
+    project_document,
 )
-from .utils import get_full_query, get_last_week_date_range, get_pids_from_docs
+
+BACKOFFICE_PREFETCH_PAGES = 4
+
+_END_OF_PAGES = object()
 
 
 def get_library_catalogue_backoffice_urls() -> List[str]:
     return [
-        LIBRARY_CATALOGUE_BACKOFFICE_ITEMS_API,
-        LIBRARY_CATALOGUE_BACKOFFICE_EITEMS_API,
+        settings.LIBRARY_CATALOGUE_BACKOFFICE_ITEMS_API,
+        settings.LIBRARY_CATALOGUE_BACKOFFICE_EITEMS_API,
     ]
 
 
-def get_backoffice_latest_pids() -> List[str]:
-    created = get_last_week_date_range()
+def iter_backoffice_pids(
+    url: str, headers: dict, page_size: Optional[int]
+) -> Iterator[List[str]]:
+    """Follow the `links.next` pagination of one backoffice endpoint.
+
+    Yields the PIDs of every page as soon as it is downloaded. The first page
+    asks for `page_size` hits. If the server rejects that size, it is halved
+    until accepted, falling back to the server default size.
+    """
+    json_response = None
+    while json_response is None:
+        first_url = f"{url}&size={page_size}" if page_size else url
+        try:
+            json_response = get_json(first_url, headers=headers, stage="backoffice")
+        except RequestError as e:
+            if e.status_code != 400 or not page_size:
+                raise
+            increment("retries", "backoffice")
+            page_size = page_size // 2 if page_size > 10 else None
+
+    while json_response:
+        hits = json_response.get("hits", {}).get("hits", [])
+        yield get_pids_from_docs(hits)
+        next_url = json_response.get("links", {}).get("next", None)
+        json_response = (
+            get_json(next_url, headers=headers, stage="backoffice")
+            if next_url
+            else None
+        )
+
+
+def _put_page(pages: queue.Queue, page: object, stop: Event) -> bool:
+    """Put `page` in `pages`, waiting for room until `stop` is set."""
+    while not stop.is_set():
+        try:
+            pages.put(page, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _download_backoffice_pages(
+    url: str, headers: dict, page_size: int, pages: queue.Queue, stop: Event
+) -> None:
+    try:
+        for page in iter_backoffice_pids(url, headers, page_size):
+            if not _put_page(pages, page, stop):
+                return
+    finally:
+        # a stopped consumer no longer reads the sentinel
+        _put_page(pages, _END_OF_PAGES, stop)
+
+
+@timed_stage("backoffice")
+def iter_backoffice_latest_pids(
+    page_size: int = None, window: Optional[List[str]] = None
+) -> Iterator[str]:
+    """Yield the PIDs created last week, or in `window`, items first and
+    eitems second.
+
+    Both endpoints are downloaded at the same time, each into a queue of at
+    most `BACKOFFICE_PREFETCH_PAGES` pages so memory stays bounded while the
+    caller is still busy with earlier PIDs.
+    """
+    if page_size is None:
+        page_size = settings.BACKOFFICE_PAGE_SIZE
+    created = window or get_last_week_date_range()
     query = get_full_query(created=created, restricted=False)
     query_encoded = urllib.parse.quote(query)
 
-    pids = []
     headers = {
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {LIBRARY_CATALOGUE_BACKOFFICE_API_TOKEN}",
+        "Authorization": f"Bearer {settings.LIBRARY_CATALOGUE_BACKOFFICE_API_TOKEN}",
     }
-    for url in get_library_catalogue_backoffice_urls():
-        next_url = f"{url}{query_encoded}"
-        while next_url:
-            response = requests.get(next_url, headers=headers)
-            try:
-                response.raise_for_status()
-            except requests.exceptions.HTTPError as e:
-                raise Exception(f"Request failed with status code: {e}")
+    urls = [f"{url}{query_encoded}" for url in get_library_catalogue_backoffice_urls()]
+
+    stop = Event()
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        downloads = []
+        for url in urls:
+            pages = queue.Queue(maxsize=BACKOFFICE_PREFETCH_PAGES)
+            future = submit(
+                executor,
+                _download_backoffice_pages,
+                url,
+                headers,
+                page_size,
+                pages,
+                stop,
+            )
+            downloads.append((pages, future))
 
-            json_response = response.json()
-            hits = json_response.get("hits", {}).get("hits", [])
-            pids.extend(get_pids_from_docs(hits))
-            next_url = json_response.get("links", {}).get("next", None)
+        try:
+            for pages, future in downloads:
+                while (page := pages.get()) is not _END_OF_PAGES:
+                    yield from page
+                # re-raise the download error, if any
+                future.result()
+        finally:
+            stop.set()
+            # unblock the downloads before the executor waits for them
+            for pages, _ in downloads:
+                while not pages.empty():
+                    pages.get_nowait()
 
-    return pids
 
+def get_backoffice_latest_pids(
+    page_size: int = None, window: Optional[List[str]] = None
+) -> List[str]:
+    return list(iter_backoffice_latest_pids(page_size, window))
 
-def get_api_url(query: str) -> str:
+
+def get_api_url(query: str, size: int = None) -> str:
     query_encoded = urllib.parse.quote(query)
-    return f"{LIBRARY_CATALOGUE_SITE_API}{query_encoded}"
+    if size:
+        return f"{settings.LIBRARY_CATALOGUE_SITE_API}{query_encoded}&size={size}"
+    return f"{settings.LIBRARY_CATALOGUE_SITE_API}{query_encoded}"
 
 
 def get_catalogue_site_url(query: str) -> str:
     query_encoded = urllib.parse.quote(query)
-    return f"{LIBRARY_CATALOGUE_SITE_URL}{query_encoded}"
+    return f"{settings.LIBRARY_CATALOGUE_SITE_URL}{query_encoded}"
 
 
-def get_results_from_pids(pids: List[str], subjects: List[str]) -> List[dict]:
-    results = []
+def iter_pid_chunks(
+    pids: Iterable[str],
+    subjects: List[str],
+    max_url_bytes: int = None,
+) -> Iterator[List[str]]:
+    """Yield the unique `pids`, in order, packed into as few chunks as possible.
 
-    # divide pids into chunks of 40 to reduce query size
-    for i in range(0, len(pids), 40):
-        chunked_pids = pids[i : i + 40]
-        if not chunked_pids:
-            continue
-        catalogue_site_query = get_full_query(pid=chunked_pids, subject=subjects)
-        result = get_site_api_docs(catalogue_site_query)
-        results.extend(result)
+    Each chunk is as large as fits in a literature API url (query and page
+    size included) of at most `max_url_bytes` encoded bytes. A PID too long
+    for the budget on its own is yielded alone.
+    """
 
-    return results, catalogue_site_query
+    def get_pid_length(pid: str) -> int:
+        return len(urllib.parse.quote(f"pid: {pid}"))
 
+    max_url_bytes = max_url_bytes or settings.CATALOGUE_MAX_URL_BYTES
+    separator_length = len(urllib.parse.quote(" OR "))
+    empty_pid_query = get_full_query(pid=[""], subject=subjects)
+    base_length = len(get_api_url(empty_pid_query, size=10**5)) - get_pid_length("")
 
-def get_site_api_docs(query: str) -> List[dict]:
-    url = get_api_url(query)
-    response = requests.get(url)
-    try:
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        raise Exception(f"Request failed with status code: {e}")
+    chunk, chunk_length = [], base_length
+    for pid in iter_unique(pids):
+        pid_length = get_pid_length(pid) + (separator_length if chunk else 0)
+        if chunk and chunk_length + pid_length > max_url_bytes:
+            yield chunk
+            chunk, chunk_length = [], base_length
+            pid_length = get_pid_length(pid)
+        chunk.append(pid)
+        chunk_length += pid_length
+
+    if chunk:
+        yield chunk
+
+
+@timed_stage("results")
+def iter_results_from_pids(
+    pids: Iterable[str],
+    subjects: List[str],
+    max_workers: int = None,
+    queries: List[str] = None,
+    max_url_bytes: int = None,
+) -> Iterator[dict]:
+    """Yield the catalogue documents of `pids` matching `subjects`.
+
+    `pids` is consumed lazily: every full chunk is looked up on the thread
+    pool right away, while the following PIDs are still being produced.
+    Documents are yielded in chunk order. The chunk queries are appended to
+    `queries` when given.
+    """
+    max_workers = max_workers or settings.CATALOGUE_MAX_WORKERS
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunked_pids in iter_pid_chunks(pids, subjects, max_url_bytes):
+            catalogue_site_query = get_full_query(pid=chunked_pids, subject=subjects)
+            if queries is not None:
+                queries.append(catalogue_site_query)
+            in_flight.append(
+                submit(
+                    executor,
+                    get_site_api_docs,
+                    catalogue_site_query,
+                    len(chunked_pids),
+                )
+            )
+            # bound the lookups waiting to be consumed
+            if len(in_flight) >= 2 * max_workers:
+                yield from in_flight.popleft().result()
+
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def get_results_from_pids(
+    pids: Iterable[str],
+    subjects: List[str],
+    max_workers: int = None,
+    max_url_bytes: int = None,
+) -> Tuple[List[dict], List[str]]:
+    catalogue_site_queries = []
+    results = list(
+        iter_results_from_pids(
+            pids, subjects, max_workers, catalogue_site_queries, max_url_bytes
+        )
+    )
+    return results, catalogue_site_queries
+
+
+@timed_stage("results")
+def iter_latest_subject_docs(
+    subjects: List[str], page_size: int = None, window: Optional[List[str]] = None
+) -> Iterator[dict]:
+    """Yield the catalogue documents created or updated last week, or in
+    `window`, in `subjects`.
+
+    The date window and the subjects filter are pushed down to a single
+    paginated literature API query, skipping the backoffice PIDs. Documents
+    that only got a new item or eitem last week are not matched.
+    """
+    query = get_latest_subject_query(subjects, window)
+    yield from iter_site_api_docs(query, page_size)
+
+
+def iter_site_api_docs(query: str, page_size: int = None) -> Iterator[dict]:
+    """Yield the projected documents of every literature API page of `query`."""
+    next_url = get_api_url(query, page_size or settings.CATALOGUE_PAGE_SIZE)
+    while next_url:
+        docs, next_url = get_site_api_page(next_url)
+        yield from docs
+
+
+def get_site_api_page(url: str) -> Tuple[List[dict], Optional[str]]:
+    """Return the projected documents of a literature API page and the next url.
+
+    Only the projected documents outlive the call, not the parsed page.
+    """
+    json_response = get_json(url, stage="results")
+    hits = json_response.get("hits", {}).get("hits", [])
+    next_url = json_response.get("links", {}).get("next", None)
+    return [project_document(hit) for hit in hits], next_url
 
-    hits, count = response.json().get("hits", {}).values()
-    if count == 0:
-        return []
 
-    return hits
+def get_site_api_docs(query: str, size: int = None) -> List[dict]:
+    docs, _ = get_site_api_page(get_api_url(query, size))
+    return docs
 
 
 def send_channel_request(data: str, target: str) -> int:
     headers = {
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {NOTIFICATIONS_API_SECRET}",
+        "Authorization": f"Bearer {settings.NOTIFICATIONS_API_SECRET}",
     }
     request_data = {
-        "target": NOTIFICATIONS_CHANNEL_ID,
+        "target": settings.NOTIFICATIONS_CHANNEL_ID,
         "summary": "Library Updates",
         "priority": "NORMAL",
         "body": data,
         "targetGroups": [{"groupIdentifier": f"{target}"}],
     }
 
-    response = requests.post(
-        NOTIFICATIONS_API_URL, headers=headers, data=json.dumps(request_data)
+    body = json.dumps(request_data)
+    timeout = get_timeout("send")
+    start = get_metrics().clock()
+    response = get_session().post(
+        settings.NOTIFICATIONS_API_URL, headers=headers, data=body, timeout=timeout
     )
+    increment("request_seconds", "send", get_metrics().clock() - start)
+    increment("requests", "send")
+    increment("request_bytes", "send", len(body.encode()))
+    increment("response_bytes", "send", len(response.content))
     return response
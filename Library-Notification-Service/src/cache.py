@@ -0,0 +1,127 @@
+"""Module caching catalogue responses on disk."""
+
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+from typing import Callable, Optional
+
+from .env import settings
+
+
+def get_cache_key(url: str, method: str = "GET") -> str:
+    """Return `url` with decoded, whitespace-normalised and sorted parameters."""
+    parsed = urllib.parse.urlsplit(url)
+    params = sorted(
+        (name, " ".join(value.split()))
+        for name, value in urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)
+    )
+    query = "&".join(f"{name}={value}" for name, value in params)
+    return f"{method} {parsed.scheme}://{parsed.netloc}{parsed.path}?{query}"
+
+
+class ResponseCache:
+    """SQLite store of response bodies, expired after `ttl` seconds.
+
+    When the stored bodies exceed `max_bytes`, the least recently used ones
+    are evicted.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        ttl: float = None,
+        max_bytes: int = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "responses.sqlite")
+        self.ttl = settings.HTTP_CACHE_TTL if ttl is None else ttl
+        self.max_bytes = max_bytes or settings.HTTP_CACHE_MAX_BYTES
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, body BLOB NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = self.clock()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT body FROM responses WHERE key = ? AND created > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+        return row[0]
+
+    def set(self, key: str, body: bytes) -> None:
+        now = self.clock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, body, len(body), now, now),
+            )
+            self._connection.execute(
+                "DELETE FROM responses WHERE created <= ?", (now - self.ttl,)
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        (total,) = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+
+        evicted = []
+        rows = self._connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def purge(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+_cache = None
+_cache_enabled = True
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[ResponseCache]:
+    """Return the shared cache, `None` when disabled or `HTTP_CACHE_DIR` unset."""
+    global _cache
+    with _cache_lock:
+        if _cache is None and _cache_enabled and settings.HTTP_CACHE_DIR:
+            _cache = ResponseCache(settings.HTTP_CACHE_DIR)
+        return _cache
+
+
+def configure_cache(enabled: bool = True, purge: bool = False) -> None:
+    global _cache, _cache_enabled
+    if purge and (cache := get_cache()):
+        cache.purge()
+
+    with _cache_lock:
+        _cache_enabled = enabled
+        if not _cache_enabled and _cache is not None:
+            _cache.close()
+            _cache = None
@@ -1,14 +1,51 @@
+import importlib
+
 import click
 
-from .providers import library_newsletter
+from .env import ConfigurationError
+
+
+class LazyGroup(click.Group):
+    """Group importing the module of a command only when it is needed.
+
+    `lazy_commands` maps the command names to "module:attribute" paths,
+    relative to this package.
+    """
+
+    def __init__(self, *args, lazy_commands: dict = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
 
+    def list_commands(self, ctx):
+        return sorted([*super().list_commands(ctx), *self.lazy_commands])
 
-@click.group()
+    def get_command(self, ctx, name):
+        if name not in self.lazy_commands:
+            return super().get_command(ctx, name)
+        module_name, attribute = self.lazy_commands[name].split(":")
+        module = importlib.import_module(module_name, package=__package__)
+        return getattr(module, attribute)
+
+    def invoke(self, ctx):
+        try:
+            return super().invoke(ctx)
+        except ConfigurationError as e:
+            raise click.ClickException(str(e))
+
+
+@click.group(
+    cls=LazyGroup,
+    lazy_commands={
+        "newsletter": ".providers.library_newsletter:cli",
+        "newsletter-batch": ".providers.library_newsletter:batch",
+        "serve": ".providers.library_newsletter:serve",
+        "index-sync": ".providers.library_newsletter:sync",
+        "preview": ".providers.library_newsletter:preview",
+    },
+)
 def main():
     pass
 
 
-main.add_command(library_newsletter.cli, "newsletter")
-
 if __name__ == "__main__":
     main()
@@ -0,0 +1,137 @@
+"""Module providing the shared http session used for every outgoing request."""
+
+import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
+
+from .cache import get_cache, get_cache_key
+from .deadline import check_deadline, get_timeout
+from .env import settings
+from .metrics import get_metrics, increment
+
+try:
+    # optional, parses the catalogue responses several times faster
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class RequestError(Exception):
+    def __init__(self, message: str, status_code: int = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_session(
+    pool_size: int = None,
+    max_retries: int = None,
+    backoff_factor: float = None,
+) -> requests.Session:
+    """Create a session keeping up to `pool_size` connections alive per host.
+
+    Idempotent requests are retried with exponential backoff on connection
+    errors and on the `RETRY_STATUS_CODES` responses. Read timeouts are not
+    retried here but by `get_json`, with the timeout left to the run.
+    """
+    pool_size = pool_size or settings.HTTP_POOL_SIZE
+    retry = Retry(
+        total=settings.HTTP_MAX_RETRIES if max_retries is None else max_retries,
+        read=False,
+        backoff_factor=backoff_factor or settings.HTTP_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def close_session() -> None:
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def loads(body: bytes):
+    return orjson.loads(body) if orjson else json.loads(body)
+
+
+def is_timeout(error: requests.exceptions.RequestException) -> bool:
+    """Whether `error` is a timeout, also once wrapped by the retries."""
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, ReadTimeoutError)
+
+
+def get_json(url: str, headers: dict = None, stage: str = None) -> dict:
+    """GET `url` as json, served from the response cache when enabled.
+
+    The request is counted in the metrics of `stage`, when given, and
+    bounded by the time left to that phase of the run deadline. Timeouts
+    are retried up to HTTP_MAX_RETRIES times, every attempt bounded by the
+    time left then.
+    """
+    increment("pages", stage)
+    cache = get_cache()
+    if cache and (body := cache.get(get_cache_key(url))) is not None:
+        increment("cache_hits", stage)
+        return loads(body)
+
+    start = get_metrics().clock()
+    attempt = 0
+    while True:
+        timeout = get_timeout(stage)
+        try:
+            response = get_session().get(url, headers=headers, timeout=timeout)
+            break
+        except requests.exceptions.RequestException as e:
+            if not is_timeout(e):
+                raise
+            # out of time for the phase rather than a slow server
+            check_deadline(stage)
+            if attempt >= settings.HTTP_MAX_RETRIES:
+                raise
+            attempt += 1
+            increment("retries", stage)
+    increment("request_seconds", stage, get_metrics().clock() - start)
+    increment("requests", stage)
+    increment("response_bytes", stage, len(response.content))
+    if retries := getattr(response.raw, "retries", None):
+        increment("retries", stage, len(retries.history))
+    try:
+        response.raise_for_status()
+    except requests.exceptions.HTTPError as e:
+        raise RequestError(
+            f"Request failed with status code: {e}", response.status_code
+        )
+
+    json_response = loads(response.content)
+    if cache:
+        cache.set(get_cache_key(url), response.content)
+    return json_response
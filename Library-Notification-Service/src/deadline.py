@@ -0,0 +1,101 @@
+"""Module bounding the duration of the http requests and of a whole run.
+
+Every request gets the HTTP_CONNECT_TIMEOUT/HTTP_READ_TIMEOUT timeouts. A
+run started with `run_deadline` must also end within RUN_DEADLINE seconds,
+split across its phases: each phase has to be over by its share of the
+deadline, so a stalled backoffice cannot eat the time of the catalogue
+lookups or of the notifications.
+"""
+
+import contextvars
+import time
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, Tuple
+
+from .env import ConfigurationError, settings
+
+# phase: share of the run deadline by which the phase has to be over,
+# the backoffice and catalogue phases overlap while the PIDs stream in
+PHASES = {"backoffice": 0.4, "results": 0.8, "send": 1.0}
+
+POLICIES = ("partial", "fail")
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, phase: str) -> None:
+        super().__init__(f"Run deadline exceeded during the {phase} phase")
+        self.phase = phase
+
+
+class Deadline:
+    def __init__(
+        self, seconds: float, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.clock = clock
+        self.start = clock()
+        self.seconds = seconds
+
+    def get_remaining(self, phase: Optional[str]) -> float:
+        end = self.start + self.seconds * PHASES.get(phase, 1.0)
+        return end - self.clock()
+
+    def check(self, phase: Optional[str]) -> None:
+        if self.get_remaining(phase) <= 0:
+            raise DeadlineExceeded(phase)
+
+
+def get_deadline() -> Optional[Deadline]:
+    return _deadline.get()
+
+
+def get_deadline_policy() -> str:
+    if settings.DEADLINE_POLICY not in POLICIES:
+        raise ConfigurationError(
+            f"Invalid environment variable DEADLINE_POLICY: "
+            f"{settings.DEADLINE_POLICY!r}, expected one of {', '.join(POLICIES)}"
+        )
+    return settings.DEADLINE_POLICY
+
+
+@contextmanager
+def run_deadline(seconds: float = None) -> Iterator[Optional[Deadline]]:
+    """Bound the requests sent in this context to `seconds`, RUN_DEADLINE by
+    default, no bound when 0.
+    """
+    seconds = settings.RUN_DEADLINE if seconds is None else seconds
+    token = _deadline.set(Deadline(seconds) if seconds else None)
+    try:
+        yield _deadline.get()
+    finally:
+        _deadline.reset(token)
+
+
+def check_deadline(phase: Optional[str]) -> None:
+    """Raise `DeadlineExceeded` when `phase` is out of time."""
+    if deadline := _deadline.get():
+        deadline.check(phase)
+
+
+def get_timeout(phase: Optional[str]) -> Tuple[float, float]:
+    """Return the (connect, read) timeouts of a request sent during `phase`.
+
+    Raises `DeadlineExceeded` when `phase` is out of time already.
+    """
+    connect_timeout = settings.HTTP_CONNECT_TIMEOUT
+    read_timeout = settings.HTTP_READ_TIMEOUT
+    if deadline := _deadline.get():
+        remaining = deadline.get_remaining(phase)
+        if remaining <= 0:
+            raise DeadlineExceeded(phase)
+        connect_timeout = min(connect_timeout, remaining)
+        read_timeout = min(read_timeout, remaining)
+    return connect_timeout, read_timeout
+
+
+def submit(executor: Executor, function: Callable, *args, **kwargs) -> Future:
+    """`executor.submit` running `function` under the deadline of the caller."""
+    context = contextvars.copy_context()
+    return executor.submit(context.run, function, *args, **kwargs)
@@ -0,0 +1,150 @@
+"""Module dispatching notifications to many target groups."""
+
+import email.utils
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import requests
+
+from .api import send_channel_request
+from .client import RETRY_STATUS_CODES
+from .deadline import DeadlineExceeded, get_deadline, submit
+from .env import settings
+from .metrics import increment, timed_stage
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Space the calls to `wait` at least 1 / `rate` seconds apart, across threads."""
+
+    def __init__(self, rate: float, clock: Callable[[], float] = time.monotonic):
+        self.interval = 1 / rate if rate else 0
+        self.clock = clock
+        self._next_call = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, sleep: Callable[[float], None] = time.sleep) -> None:
+        with self._lock:
+            now = self.clock()
+            call_at = max(self._next_call, now)
+            self._next_call = call_at + self.interval
+        if call_at > now:
+            sleep(call_at - now)
+
+
+def get_retry_after(response: requests.Response) -> Optional[float]:
+    """Return the seconds to wait from the `Retry-After` header, if any."""
+    retry_after = response.headers.get("Retry-After")
+    if not retry_after:
+        return None
+    if retry_after.isdigit():
+        return float(retry_after)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+def send_with_retries(
+    message: str,
+    target: str,
+    rate_limiter: RateLimiter,
+    max_retries: int = None,
+    backoff_factor: float = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> dict:
+    """Send one notification, retrying 429/5xx responses and connection errors.
+
+    The wait before a retry is the `Retry-After` of the response when given,
+    exponential backoff otherwise. There is no retry past the run deadline.
+    """
+    if max_retries is None:
+        max_retries = settings.NOTIFICATIONS_MAX_RETRIES
+    backoff_factor = backoff_factor or settings.NOTIFICATIONS_BACKOFF_FACTOR
+    result = {"target": target, "sent": False, "attempts": 0, "status_code": None}
+    for attempt in range(max_retries + 1):
+        rate_limiter.wait(sleep)
+        result["attempts"] += 1
+        if attempt:
+            increment("retries", "send")
+        retry_after = None
+        try:
+            response = send_channel_request(message, target)
+        except DeadlineExceeded as e:
+            result.update(error=str(e))
+            return result
+        except requests.exceptions.RequestException as e:
+            result.update(status_code=None, error=str(e))
+        else:
+            result.update(status_code=response.status_code, error=response.text)
+            if response.status_code == 200:
+                result.update(sent=True, error=None)
+                return result
+            if response.status_code not in RETRY_STATUS_CODES:
+                return result
+            retry_after = get_retry_after(response)
+
+        if attempt < max_retries:
+            delay = backoff_factor * 2**attempt if retry_after is None else retry_after
+            deadline = get_deadline()
+            if deadline and deadline.get_remaining("send") < delay:
+                logger.warning(f"Notification to {target} not retried, no time left")
+                return result
+            logger.warning(
+                f"Notification to {target} failed ({result['status_code']}), "
+                f"retrying in {delay:.1f}s"
+            )
+            sleep(delay)
+
+    return result
+
+
+@timed_stage("send")
+def dispatch_notifications(
+    notifications: List[Tuple[str, str]],
+    max_workers: int = None,
+    rate_limit: float = None,
+    max_retries: int = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> List[dict]:
+    """Send the (target, message) notifications concurrently.
+
+    At most `rate_limit` requests per second are sent across all the workers.
+    Returns one result per notification, in the same order.
+    """
+    if rate_limit is None:
+        rate_limit = settings.NOTIFICATIONS_RATE_LIMIT
+    rate_limiter = RateLimiter(rate_limit)
+    max_workers = max_workers or settings.NOTIFICATIONS_MAX_WORKERS
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            submit(
+                executor,
+                send_with_retries,
+                message,
+                target,
+                rate_limiter,
+                max_retries=max_retries,
+                sleep=sleep,
+            )
+            for target, message in notifications
+        ]
+        results = [future.result() for future in futures]
+    increment("results", "send", sum(result["sent"] for result in results))
+    return results
+
+
+def write_summary(results: List[dict], path: str) -> None:
+    summary = {
+        "sent": sum(result["sent"] for result in results),
+        "failed": sum(not result["sent"] for result in results),
+        "targets": results,
+    }
+    with open(path, "w") as summary_file:
+        json.dump(summary, summary_file, indent=2)
@@ -1,24 +1,89 @@
-"""Module to retreive/declare the environment variables."""
+"""Module to retreive/declare the environment variables.
+
+The variables are read from the environment, cast and validated the first
+time they are accessed on `settings`, so commands which do not need them
+(e.g. `--help`) run without them.
+"""
 
 import os
 
-MAX_NOTIFICATION_RESULTS_COUNT = os.environ["MAX_NOTIFICATION_RESULTS_COUNT"]
+REQUIRED = object()
+
+# name: (type, default)
+VARIABLES = {
+    "MAX_NOTIFICATION_RESULTS_COUNT": (int, REQUIRED),
+    "LIBRARY_CATALOGUE_SITE_API": (str, REQUIRED),
+    "LIBRARY_CATALOGUE_SITE_URL": (str, REQUIRED),
+    "LIBRARY_CATALOGUE_BACKOFFICE_ITEMS_API": (str, REQUIRED),
+    "LIBRARY_CATALOGUE_BACKOFFICE_EITEMS_API": (str, REQUIRED),
+    "LIBRARY_CATALOGUE_BACKOFFICE_API_TOKEN": (str, REQUIRED),
+    "NOTIFICATIONS_API_URL": (str, REQUIRED),
+    "NOTIFICATIONS_API_SECRET": (str, REQUIRED),
+    "NOTIFICATIONS_CHANNEL_ID": (str, REQUIRED),
+    "HTTP_POOL_SIZE": (int, 10),
+    "HTTP_MAX_RETRIES": (int, 3),
+    "HTTP_BACKOFF_FACTOR": (float, 0.5),
+    "HTTP_CONNECT_TIMEOUT": (float, 5.0),
+    "HTTP_READ_TIMEOUT": (float, 30.0),
+    # seconds, 0 for no run deadline
+    "RUN_DEADLINE": (float, 0.0),
+    # partial: send what arrived in time, fail: fail the run
+    "DEADLINE_POLICY": (str, "partial"),
+    "CATALOGUE_MAX_WORKERS": (int, 4),
+    "CATALOGUE_MAX_URL_BYTES": (int, 4000),
+    "CATALOGUE_PAGE_SIZE": (int, 100),
+    "BACKOFFICE_PAGE_SIZE": (int, 200),
+    "NOTIFICATIONS_MAX_WORKERS": (int, 4),
+    "NOTIFICATIONS_RATE_LIMIT": (float, 5.0),
+    "NOTIFICATIONS_MAX_RETRIES": (int, 3),
+    "NOTIFICATIONS_BACKOFF_FACTOR": (float, 1.0),
+    "HTTP_CACHE_DIR": (str, ""),
+    "HTTP_CACHE_TTL": (float, 3600.0),
+    "HTTP_CACHE_MAX_BYTES": (int, 100 * 1024 * 1024),
+    "LEDGER_PATH": (str, ""),
+    "LEDGER_MAX_LOOKBACK_DAYS": (int, 28),
+    "INDEX_PATH": (str, ""),
+    # days synced into a new index
+    "INDEX_INITIAL_DAYS": (int, 28),
+    # run as if today was this date (YYYY-MM-DD), e.g. to resend a past week
+    "NEWSLETTER_DATE": (str, ""),
+}
+
+
+class ConfigurationError(Exception):
+    pass
+
+
+class Settings:
+    """Environment variables, read on first access and then kept."""
+
+    def __getattr__(self, name: str):
+        if name not in VARIABLES:
+            raise AttributeError(name)
+
+        cast, default = VARIABLES[name]
+        value = os.environ.get(name)
+        if value is None and default is REQUIRED:
+            raise ConfigurationError(f"Missing environment variable: {name}")
+        if value is None:
+            value = default
+        else:
+            try:
+                value = cast(value)
+            except ValueError:
+                raise ConfigurationError(
+                    f"Invalid environment variable {name}: {value!r}"
+                )
+
+        setattr(self, name, value)
+        return value
+
+    def reset(self) -> None:
+        """Forget the values read, they are read again on next access."""
+        self.__dict__.clear()
 
-LIBRARY_CATALOGUE_SITE_API = os.environ["LIBRARY_CATALOGUE_SITE_API"]
-LIBRARY_CATALOGUE_SITE_URL = os.environ["LIBRARY_CATALOGUE_SITE_URL"]
-LIBRARY_CATALOGUE_BACKOFFICE_ITEMS_API = os.environ[
-    "LIBRARY_CATALOGUE_BACKOFFICE_ITEMS_API"
-]
-LIBRARY_CATALOGUE_BACKOFFICE_EITEMS_API = os.environ[
-    "LIBRARY_CATALOGUE_BACKOFFICE_EITEMS_API"
-]
-LIBRARY_CATALOGUE_BACKOFFICE_API_TOKEN = os.environ[
-    "LIBRARY_CATALOGUE_BACKOFFICE_API_TOKEN"
-]
 
-NOTIFICATIONS_API_URL = os.environ["NOTIFICATIONS_API_URL"]
-NOTIFICATIONS_API_SECRET = os.environ["NOTIFICATIONS_API_SECRET"]
-NOTIFICATIONS_CHANNEL_ID = os.environ["NOTIFICATIONS_CHANNEL_ID"]
+settings = Settings()
 
 
 """
@@ -29,4 +94,28 @@ export LIBRARY_CATALOGUE_BACKOFFICE_ITEMS_API="https://catalogue.library.cern/ap
 export LIBRARY_CATALOGUE_BACKOFFICE_EITEMS_API="https://catalogue.library.cern/api/eitems/?q="
 export NOTIFICATIONS_API_URL="https://notifications.web.cern.ch/api/notifications"
 export NOTIFICATIONS_CHANNEL_ID="4e383ca0-7df0-421f-a062-741d5d459cd8"
+export HTTP_POOL_SIZE=10
+export HTTP_MAX_RETRIES=3
+export HTTP_BACKOFF_FACTOR=0.5
+export HTTP_CONNECT_TIMEOUT=5
+export HTTP_READ_TIMEOUT=30
+export RUN_DEADLINE=600
+export DEADLINE_POLICY="partial"
+export CATALOGUE_MAX_WORKERS=4
+export CATALOGUE_MAX_URL_BYTES=4000
+export CATALOGUE_PAGE_SIZE=100
+export BACKOFFICE_PAGE_SIZE=200
+export NOTIFICATIONS_MAX_WORKERS=4
+export NOTIFICATIONS_RATE_LIMIT=5
+export NOTIFICATIONS_MAX_RETRIES=3
+export NOTIFICATIONS_BACKOFF_FACTOR=1.0
+export HTTP_CACHE_DIR="/tmp/lns-cache"
+export HTTP_CACHE_TTL=3600
+export HTTP_CACHE_MAX_BYTES=104857600
+export LEDGER_PATH="/var/lib/lns/ledger.sqlite"
+export LEDGER_MAX_LOOKBACK_DAYS=28
+export INDEX_PATH="/var/lib/lns/index.sqlite"
+export INDEX_INITIAL_DAYS=28
+# only to re-run a past week, every run is pinned to this date while set
+# export NEWSLETTER_DATE="2024-01-15"
 """
@@ -0,0 +1,290 @@
+"""Module keeping a local index of the catalogue documents.
+
+The index stores, in an SQLite file, the fields the newsletters use (PID,
+title, subjects with their scheme, created date and restricted flag) and
+the days items or eitems were added to every document. It is synced
+incrementally from its watermark, the last day synced: only the documents
+updated since and the documents of the new items missing from the index
+are fetched from the catalogue. Digests and previews are then local
+queries.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from .env import ConfigurationError, settings
+from .subjects import WILDCARDS
+from .utils import get_date_range, get_range_query, get_today, get_window_dates
+
+# PIDs looked up per query, below the SQLite variables limit
+LOOKUP_BATCH_SIZE = 500
+
+
+def get_subjects_condition(subjects: List[str]) -> Tuple[str, List[str]]:
+    """Return the SQL condition on `pid` matching `subjects`, and its parameters.
+
+    Same semantics as `SubjectMatcher`: wildcards as in `fnmatchcase` (GLOB),
+    and the scheme of any subject of the document.
+    """
+    conditions, parameters = [], []
+    for subject in subjects:
+        value, scheme = subject.split(":")
+        operator = "GLOB" if any(wildcard in value for wildcard in WILDCARDS) else "="
+        condition = f"pid IN (SELECT pid FROM subjects WHERE value {operator} ?)"
+        parameters.append(value)
+        if scheme:
+            condition += " AND pid IN (SELECT pid FROM subjects WHERE scheme = ?)"
+            parameters.append(scheme)
+        conditions.append(f"({condition})")
+    return " OR ".join(conditions), parameters
+
+
+class DocumentIndex:
+    """SQLite store of the catalogue documents and of the days they got items."""
+
+    def __init__(self, path: str) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "pid TEXT PRIMARY KEY, title TEXT, created TEXT, "
+                "restricted INTEGER NOT NULL, synced REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS subjects ("
+                "pid TEXT NOT NULL, value TEXT NOT NULL, scheme TEXT)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS additions ("
+                "pid TEXT NOT NULL, day TEXT NOT NULL, PRIMARY KEY (pid, day))"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "name TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            for name, columns in (
+                ("subjects_pid", "subjects (pid)"),
+                ("subjects_value", "subjects (value)"),
+                ("subjects_scheme", "subjects (scheme, pid)"),
+                ("additions_day", "additions (day, pid)"),
+            ):
+                self._connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS {name} ON {columns}"
+                )
+
+    def get_watermark(self) -> Optional[date]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM state WHERE name = 'watermark'"
+            ).fetchone()
+        return date.fromisoformat(row[0]) if row else None
+
+    def set_watermark(self, watermark: date) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO state VALUES ('watermark', ?)",
+                (watermark.isoformat(),),
+            )
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM documents"
+            ).fetchone()[0]
+
+    def get_missing_pids(self, pids: Iterable[str]) -> List[str]:
+        """Return the `pids` not in the index, in order."""
+        pids = list(dict.fromkeys(pids))
+        indexed = set()
+        for index in range(0, len(pids), LOOKUP_BATCH_SIZE):
+            batch = pids[index : index + LOOKUP_BATCH_SIZE]
+            placeholders = ", ".join("?" * len(batch))
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT pid FROM documents WHERE pid IN ({placeholders})", batch
+                ).fetchall()
+            indexed.update(pid for (pid,) in rows)
+        return [pid for pid in pids if pid not in indexed]
+
+    def upsert(self, docs: Iterable[dict]) -> int:
+        """Store the projected `docs`, replacing the indexed ones, return their
+        number. Consumes `docs` lazily, in one transaction per batch.
+        """
+        count = 0
+        batch = []
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) == LOOKUP_BATCH_SIZE:
+                count += self._upsert(batch)
+                batch = []
+        return count + self._upsert(batch)
+
+    def _upsert(self, docs: List[dict]) -> int:
+        docs = [doc for doc in docs if doc.get("id")]
+        now = time.time()
+        with self._lock, self._connection:
+            for doc in docs:
+                metadata = doc.get("metadata", {})
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                    (
+                        doc["id"],
+                        metadata.get("title"),
+                        doc.get("created"),
+                        int(bool(metadata.get("restricted"))),
+                        now,
+                    ),
+                )
+                self._connection.execute(
+                    "DELETE FROM subjects WHERE pid = ?", (doc["id"],)
+                )
+                self._connection.executemany(
+                    "INSERT INTO subjects VALUES (?, ?, ?)",
+                    (
+                        (doc["id"], subject["value"], subject.get("scheme"))
+                        for subject in metadata.get("subjects", [])
+                        if subject.get("value")
+                    ),
+                )
+        return len(docs)
+
+    def add(self, day: date, pids: Iterable[str]) -> None:
+        """Record that `pids` got items or eitems on `day`."""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO additions VALUES (?, ?)",
+                ((pid, day.isoformat()) for pid in pids),
+            )
+
+    def iter_documents(
+        self, subjects: List[str], start: date, end: date
+    ) -> Iterator[dict]:
+        """Yield the documents, not restricted, in `subjects` that got items or
+        eitems from `start` to `end`, projected like the catalogue ones.
+        """
+        condition, parameters = get_subjects_condition(subjects)
+        query = (
+            "SELECT pid FROM documents WHERE NOT restricted AND pid IN "
+            "(SELECT pid FROM additions WHERE day BETWEEN ? AND ?)"
+        )
+        if condition:
+            query += f" AND ({condition})"
+        with self._lock:
+            pids = [
+                pid
+                for (pid,) in self._connection.execute(
+                    f"{query} ORDER BY pid",
+                    (start.isoformat(), end.isoformat(), *parameters),
+                )
+            ]
+        for index in range(0, len(pids), LOOKUP_BATCH_SIZE):
+            yield from self._get_documents(pids[index : index + LOOKUP_BATCH_SIZE])
+
+    def _get_documents(self, pids: List[str]) -> List[dict]:
+        placeholders = ", ".join("?" * len(pids))
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT pid, title, created FROM documents WHERE pid IN ({placeholders})",
+                pids,
+            ).fetchall()
+            subject_rows = self._connection.execute(
+                f"SELECT pid, value, scheme FROM subjects WHERE pid IN ({placeholders}) "
+                "ORDER BY rowid",
+                pids,
+            ).fetchall()
+
+        docs = {}
+        for pid, title, created in rows:
+            doc = {"id": pid, "metadata": {"subjects": []}}
+            if created is not None:
+                doc["created"] = created
+            if title is not None:
+                doc["metadata"]["title"] = title
+            docs[pid] = doc
+        for pid, value, scheme in subject_rows:
+            docs[pid]["metadata"]["subjects"].append({"value": value, "scheme": scheme})
+        return [docs[pid] for pid in pids if pid in docs]
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def sync_index(index: DocumentIndex, end: Optional[date] = None) -> int:
+    """Sync `index` up to `end`, yesterday by default, return the documents
+    fetched from the catalogue.
+
+    A new index starts INDEX_INITIAL_DAYS before `end`. The documents updated
+    since the watermark are fetched again, then, day by day, the documents of
+    the new backoffice items and eitems are recorded as added that day and
+    the ones missing from the index are fetched. The watermark moves after
+    every day, so an interrupted sync resumes where it stopped.
+    """
+    from .api import (
+        iter_backoffice_latest_pids,
+        iter_results_from_pids,
+        iter_site_api_docs,
+    )
+
+    end = end or get_today() - timedelta(days=1)
+    watermark = index.get_watermark()
+    if watermark:
+        start = watermark + timedelta(days=1)
+    else:
+        start = end - timedelta(days=settings.INDEX_INITIAL_DAYS - 1)
+    if start > end:
+        return 0
+
+    updated_query = get_range_query(get_date_range(start, end), "_updated")
+    fetched = index.upsert(iter_site_api_docs(updated_query))
+    day = start
+    while day <= end:
+        pids = list(iter_backoffice_latest_pids(window=get_date_range(day, day)))
+        index.add(day, pids)
+        missing = index.get_missing_pids(pids)
+        if missing:
+            fetched += index.upsert(iter_results_from_pids(missing, []))
+        index.set_watermark(day)
+        day += timedelta(days=1)
+    return fetched
+
+
+def iter_index_results(
+    index: DocumentIndex, subjects: List[str], window: Optional[List[str]] = None
+) -> Iterator[dict]:
+    """Sync `index` up to the end of `window`, last week by default, then
+    return an iterator on its documents added in `window` in `subjects`.
+    """
+    start, end = get_window_dates(window)
+    sync_index(index, end)
+    return index.iter_documents(subjects, start, end)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> DocumentIndex:
+    """Return the shared index, raise `ConfigurationError` without `INDEX_PATH`."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            if not settings.INDEX_PATH:
+                raise ConfigurationError("Missing environment variable: INDEX_PATH")
+            _index = DocumentIndex(settings.INDEX_PATH)
+        return _index
+
+
+def close_index() -> None:
+    global _index
+    with _index_lock:
+        if _index is not None:
+            _index.close()
+            _index = None
@@ -0,0 +1,164 @@
+"""Module keeping, per target, the notifications sent across runs.
+
+For every target the ledger stores the watermark, the last day of the
+window already notified, the digest of the last notification and the PIDs
+listed so far. The next run queries from the day after the oldest
+watermark, skips the documents already sent and does not resend an
+unchanged notification.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+from .env import settings
+from .utils import get_last_week_dates
+
+# PIDs looked up per query, below the SQLite variables limit
+LOOKUP_BATCH_SIZE = 500
+
+
+def get_digest(message: str) -> str:
+    return hashlib.sha256(message.encode()).hexdigest()
+
+
+class Ledger:
+    """SQLite store of the watermarks, digests and sent PIDs of the targets."""
+
+    def __init__(self, path: str) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS targets ("
+                "target TEXT PRIMARY KEY, watermark TEXT NOT NULL, digest TEXT, "
+                "updated REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS sent ("
+                "target TEXT NOT NULL, pid TEXT NOT NULL, sent REAL NOT NULL, "
+                "PRIMARY KEY (target, pid))"
+            )
+
+    def _get_target(self, target: str) -> Tuple[Optional[str], Optional[str]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT watermark, digest FROM targets WHERE target = ?", (target,)
+            ).fetchone()
+        return row or (None, None)
+
+    def get_watermark(self, target: str) -> Optional[date]:
+        watermark, _ = self._get_target(target)
+        return date.fromisoformat(watermark) if watermark else None
+
+    def get_digest(self, target: str) -> Optional[str]:
+        _, digest = self._get_target(target)
+        return digest
+
+    def get_window(self, targets: List[str]) -> Tuple[date, date]:
+        """Return the first and last days to notify `targets` of.
+
+        The window ends with last week and starts the day after the oldest
+        watermark, last week for a new target, going back at most
+        LEDGER_MAX_LOOKBACK_DAYS. It is empty (start after end) when every
+        target was notified of last week already.
+        """
+        last_week_start, end = get_last_week_dates()
+        starts = []
+        for target in targets:
+            watermark = self.get_watermark(target)
+            starts.append(
+                watermark + timedelta(days=1) if watermark else last_week_start
+            )
+        lookback_start = end - timedelta(days=settings.LEDGER_MAX_LOOKBACK_DAYS - 1)
+        return max(min(starts), lookback_start), end
+
+    def get_sent_pids(self, target: str, pids: Iterable[str]) -> Set[str]:
+        """Return the `pids` already sent to `target`."""
+        pids = list(pids)
+        sent = set()
+        for index in range(0, len(pids), LOOKUP_BATCH_SIZE):
+            batch = pids[index : index + LOOKUP_BATCH_SIZE]
+            placeholders = ", ".join("?" * len(batch))
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT pid FROM sent WHERE target = ? AND pid IN ({placeholders})",
+                    (target, *batch),
+                ).fetchall()
+            sent.update(pid for (pid,) in rows)
+        return sent
+
+    def iter_unsent(self, target: str, docs: Iterable[dict]) -> Iterator[dict]:
+        """Yield the `docs` not sent to `target` yet, consuming them lazily."""
+        batch = []
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) == LOOKUP_BATCH_SIZE:
+                yield from self._filter_unsent(target, batch)
+                batch = []
+        yield from self._filter_unsent(target, batch)
+
+    def _filter_unsent(self, target: str, docs: List[dict]) -> List[dict]:
+        sent = self.get_sent_pids(target, (doc.get("id") for doc in docs))
+        return [doc for doc in docs if doc.get("id") not in sent]
+
+    def record(
+        self,
+        target: str,
+        watermark: Optional[date],
+        pids: Iterable[str] = (),
+        digest: Optional[str] = None,
+    ) -> None:
+        """Record `target` notified up to `watermark` with `pids`, in one
+        transaction. The watermark and digest are kept when not given.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            if watermark:
+                self._connection.execute(
+                    "INSERT INTO targets VALUES (?, ?, ?, ?) ON CONFLICT (target) DO "
+                    "UPDATE SET watermark = excluded.watermark, "
+                    "digest = COALESCE(excluded.digest, digest), "
+                    "updated = excluded.updated",
+                    (target, watermark.isoformat(), digest, now),
+                )
+            elif digest:
+                self._connection.execute(
+                    "UPDATE targets SET digest = ?, updated = ? WHERE target = ?",
+                    (digest, now, target),
+                )
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO sent VALUES (?, ?, ?)",
+                ((target, pid, now) for pid in pids),
+            )
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> Optional[Ledger]:
+    """Return the shared ledger, `None` when `LEDGER_PATH` is unset."""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None and settings.LEDGER_PATH:
+            _ledger = Ledger(settings.LEDGER_PATH)
+        return _ledger
+
+
+def close_ledger() -> None:
+    global _ledger
+    with _ledger_lock:
+        if _ledger is not None:
+            _ledger.close()
+            _ledger = None
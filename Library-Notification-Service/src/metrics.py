@@ -0,0 +1,179 @@
+"""Module collecting per-stage metrics of a newsletter run.
+
+Stages: backoffice (PIDs of last week), results (catalogue documents),
+render (notification bodies) and send (notifications). The values are
+per run, exported as Prometheus gauges (textfile collector or pushgateway
+format) and as a JSON summary. The resident scheduler never resets them,
+and exports them as counters accumulated since it started instead.
+"""
+
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Optional
+
+# name: help, the values are recorded per stage
+METRICS = {
+    "duration_seconds": "Wall time the stage was running, streaming stages overlap.",
+    "calls": "Times the stage was run.",
+    "requests": "HTTP requests sent over the network.",
+    "request_seconds": "Time spent waiting for HTTP responses.",
+    "pages": "Responses consumed, from the network or the response cache.",
+    "cache_hits": "Responses served from the response cache.",
+    "retries": "Requests retried, on errors or a rejected page size.",
+    "response_bytes": "Bytes of the response bodies received.",
+    "request_bytes": "Bytes of the request bodies sent.",
+    "results": "PIDs, documents or notifications produced by the stage.",
+}
+
+PREFIX = "lns"
+
+
+class Metrics:
+    """Thread-safe per-stage counters of one run."""
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter) -> None:
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = defaultdict(lambda: defaultdict(int))
+            self.run = {"duration_seconds": 0.0, "success": 0, "timestamp_seconds": 0.0}
+
+    def increment(self, name: str, stage: str, value: float = 1) -> None:
+        with self._lock:
+            self._values[stage][name] += value
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            stages = {
+                stage: {name: values.get(name, 0) for name in METRICS}
+                for stage, values in self._values.items()
+            }
+        return {"run": dict(self.run), "stages": stages}
+
+    def to_prometheus(self, cumulative: bool = False) -> str:
+        """Return the metrics of the run in the Prometheus text format.
+
+        `cumulative` exports the stage values as counters, without the run
+        ones, for a process summing the stages of all its runs.
+        """
+        summary = self.to_dict()
+        lines = []
+        for name, help_text in METRICS.items():
+            metric = f"{PREFIX}_stage_{name}"
+            metric_type = "gauge"
+            if cumulative:
+                metric, metric_type = f"{metric}_total", "counter"
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {metric_type}"]
+            for stage, values in sorted(summary["stages"].items()):
+                lines.append(f'{metric}{{stage="{stage}"}} {values[name]:g}')
+        if cumulative:
+            return "\n".join(lines) + "\n"
+
+        run_help = {
+            "duration_seconds": "Wall time of the run.",
+            "success": "1 when the run succeeded, 0 otherwise.",
+            "timestamp_seconds": "Unix time the run ended at.",
+        }
+        for name, help_text in run_help.items():
+            metric = f"{PREFIX}_run_{name}"
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+            lines.append(f"{metric} {summary['run'][name]:.15g}")
+        return "\n".join(lines) + "\n"
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+def increment(name: str, stage: Optional[str], value: float = 1) -> None:
+    """Add `value` to the `name` metric of `stage`, nothing without a stage."""
+    if stage:
+        _metrics.increment(name, stage, value)
+
+
+def timed_stage(stage: str):
+    """Record the calls and duration of the decorated function as `stage`.
+
+    Generator functions are timed from their first item until exhausted, and
+    the items they yield are counted as results.
+    """
+
+    def decorator(function):
+        if inspect.isgeneratorfunction(function):
+
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                increment("calls", stage)
+                start = _metrics.clock()
+                try:
+                    for item in function(*args, **kwargs):
+                        increment("results", stage)
+                        yield item
+                finally:
+                    increment("duration_seconds", stage, _metrics.clock() - start)
+
+            return generator_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            increment("calls", stage)
+            start = _metrics.clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                increment("duration_seconds", stage, _metrics.clock() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def _write_atomically(path: str, content: str) -> None:
+    # the textfile collector may read the file at any time
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as temporary_file:
+        temporary_file.write(content)
+    os.replace(temporary_path, path)
+
+
+def write_metrics(
+    prometheus_path: Optional[str] = None, json_path: Optional[str] = None
+) -> None:
+    if prometheus_path:
+        _write_atomically(prometheus_path, _metrics.to_prometheus())
+    if json_path:
+        _write_atomically(json_path, json.dumps(_metrics.to_dict(), indent=2))
+
+
+def record_run(command):
+    """Reset the metrics before `command` runs and record its duration/outcome.
+
+    The metrics are written to the `metrics_prometheus` and `metrics_json`
+    paths given to `command`, even when it fails.
+    """
+
+    @functools.wraps(command)
+    def wrapper(*args, metrics_prometheus=None, metrics_json=None, **kwargs):
+        _metrics.reset()
+        start = _metrics.clock()
+        try:
+            result = command(*args, **kwargs)
+            _metrics.run["success"] = 1
+            return result
+        finally:
+            _metrics.run["duration_seconds"] = _metrics.clock() - start
+            _metrics.run["timestamp_seconds"] = time.time()
+            write_metrics(metrics_prometheus, metrics_json)
+
+    return wrapper
@@ -1,19 +1,375 @@
 """The command line module containing all the commands to filter documents."""
 
+import json
 import logging
-from typing import Tuple
+import signal
+from datetime import datetime, timedelta
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import click
 
-from ..api import (
-    get_backoffice_latest_pids,
-    get_results_from_pids,
-    send_channel_request,
+from ..env import settings
+from ..metrics import record_run
+from ..subjects import SubjectMatcher
+from ..utils import (
+    SORT_KEYS,
+    create_channel_message,
+    get_date_range,
+    get_full_query,
+    get_latest_subject_query,
+    get_today,
+    get_window_dates,
+    iter_unique,
+    select_top_results,
 )
-from ..utils import create_channel_message
+
+# ..api, ..cache and ..dispatch pull in requests and sqlite3, they are
+# imported where used so that the CLI starts fast
 
 logger = logging.getLogger(__name__)
 
+# pids: resolve the backoffice PIDs created last week in the catalogue
+# pushdown: ask the catalogue directly for the documents of last week
+# index: sync the local document index (INDEX_PATH), then query it
+STRATEGIES = ("pids", "pushdown", "index")
+
+
+def load_newsletters_config(path: str) -> List[Dict]:
+    """Load the list of newsletters (subjects, title, target) from a JSON file."""
+    with open(path) as config_file:
+        try:
+            config = json.load(config_file)
+        except json.JSONDecodeError as e:
+            raise click.ClickException(f"Invalid newsletters config {path}: {e}")
+
+    newsletters = config.get("newsletters", []) if isinstance(config, dict) else []
+    for newsletter in newsletters:
+        missing = {"subjects", "title", "target"} - newsletter.keys()
+        if missing:
+            raise click.ClickException(
+                f"Newsletter {newsletter} is missing: {', '.join(sorted(missing))}"
+            )
+        subjects = newsletter["subjects"]
+        if (
+            not isinstance(subjects, list)
+            or not subjects
+            or not all(
+                isinstance(subject, str) and subject.count(":") == 1
+                for subject in subjects
+            )
+        ):
+            raise click.ClickException(
+                f"Newsletter {newsletter['target']} subjects must be a non-empty "
+                f"list of value:scheme strings, got: {subjects!r}"
+            )
+    return newsletters
+
+
+def strategy_option(command):
+    return click.option(
+        "--strategy",
+        type=click.Choice(STRATEGIES),
+        default="pids",
+        show_default=True,
+        help="pids resolves the backoffice items/eitems created last week, "
+        "pushdown runs one catalogue query per subjects on the documents "
+        "created or updated last week, index syncs the local document index "
+        "(INDEX_PATH) and queries it.",
+    )(command)
+
+
+def cache_options(command):
+    command = click.option(
+        "--no-cache",
+        is_flag=True,
+        help="Bypass the catalogue response cache (HTTP_CACHE_DIR).",
+    )(command)
+    command = click.option(
+        "--purge-cache",
+        is_flag=True,
+        help="Empty the catalogue response cache before running.",
+    )(command)
+    return command
+
+
+def recording_options(command):
+    command = click.option(
+        "--record",
+        type=click.Path(file_okay=False, writable=True),
+        help="Save every catalogue and notification exchange to this directory.",
+    )(command)
+    command = click.option(
+        "--replay",
+        type=click.Path(exists=True, file_okay=False),
+        help="Serve the exchanges saved with --record instead of the network.",
+    )(command)
+    return command
+
+
+def configure_http(
+    no_cache: bool, purge_cache: bool, record: Optional[str], replay: Optional[str]
+) -> None:
+    """Set up the response cache and the recording/replay of the traffic.
+
+    The cache is bypassed while recording or replaying, every exchange must
+    go through the session.
+    """
+    from ..cache import configure_cache
+    from ..recording import configure_recording
+
+    if record and replay:
+        raise click.UsageError("--record and --replay are mutually exclusive.")
+    configure_cache(enabled=not (no_cache or record or replay), purge=purge_cache)
+    configure_recording(record, replay)
+
+
+def iter_newsletter_results(
+    subjects: List[str], strategy: str, window: Optional[List[str]] = None
+) -> Optional[Iterator[dict]]:
+    """Return the documents of last week, or of `window`, in `subjects`.
+
+    Returns None when the backoffice has no updates with the pids strategy.
+    """
+    from ..api import (
+        iter_backoffice_latest_pids,
+        iter_latest_subject_docs,
+        iter_results_from_pids,
+    )
+
+    if strategy == "pushdown":
+        return iter_latest_subject_docs(subjects, window=window)
+    if strategy == "index":
+        from ..index import get_index, iter_index_results
+
+        return iter_index_results(get_index(), subjects, window)
+
+    latest_pids = iter_backoffice_latest_pids(window=window)
+    first_pid = next(latest_pids, None)
+    if first_pid is None:
+        return None
+    return iter_results_from_pids(chain([first_pid], latest_pids), subjects)
+
+
+def render_newsletter(
+    results: Iterable[dict],
+    subjects: List[str],
+    title: str,
+    sort: str = "newest",
+    window: Optional[List[str]] = None,
+    listed_pids: Optional[List[str]] = None,
+) -> Optional[str]:
+    """Render the notification body, None when there are no results.
+
+    Only the first MAX_NOTIFICATION_RESULTS_COUNT results in `sort` order are
+    listed, followed by a catalogue search of the PIDs of the others, or,
+    when they do not fit in CATALOGUE_MAX_URL_BYTES, by a link to the
+    general search of `subjects` in `window`. The listed PIDs are appended
+    to `listed_pids` when given.
+    """
+    from ..api import get_catalogue_site_url
+
+    pids = []
+
+    def iter_results():
+        for doc in results:
+            pids.append(doc.get("id"))
+            yield doc
+
+    # select while the results are still streaming in
+    top_results, total = select_top_results(
+        iter_results(), settings.MAX_NOTIFICATION_RESULTS_COUNT, sort
+    )
+    if not total:
+        click.echo(f"No results visible in the catalogue! {subjects}")
+        return None
+
+    click.echo(f"Subject: {subjects} -  Title: {title} - Results: {total} results.")
+    top_pids = [doc.get("id") for doc in top_results]
+    if listed_pids is not None:
+        listed_pids.extend(top_pids)
+    listed = set(top_pids)
+    more_pids = [pid for pid in iter_unique(pids) if pid and pid not in listed]
+    more_url = get_catalogue_site_url(get_full_query(pid=more_pids))
+    more_label = None
+    if len(more_url) > settings.CATALOGUE_MAX_URL_BYTES:
+        more_url = get_catalogue_site_url(get_latest_subject_query(subjects, window))
+        more_label = "all the latest books/e-books in these subjects"
+    return create_channel_message(
+        top_results, title, total - len(top_results), more_url, more_label
+    )
+
+
+def send_notifications(
+    notifications: List[Tuple[str, str]], summary: Optional[str] = None
+) -> List[str]:
+    """Dispatch the (target, message) notifications, return the failed targets."""
+    from ..dispatch import dispatch_notifications, write_summary
+
+    results = dispatch_notifications(notifications)
+    for result in results:
+        if result["sent"]:
+            click.echo(f"Notification sent successfully to {result['target']}!")
+            continue
+
+        error = (
+            f"Notification to {result['target']} failed with status code: "
+            f"{result['status_code']}:{result['error']}"
+        )
+        logger.error(error)
+        click.echo(error, err=True)
+
+    if summary:
+        write_summary(results, summary)
+    return [result["target"] for result in results if not result["sent"]]
+
+
+def metrics_options(command):
+    command = record_run(command)
+    command = click.option(
+        "--metrics-prometheus",
+        type=click.Path(dir_okay=False, writable=True),
+        help="Write the per-stage metrics of the run to this Prometheus "
+        "textfile (also accepted by a pushgateway).",
+    )(command)
+    command = click.option(
+        "--metrics-json",
+        type=click.Path(dir_okay=False, writable=True),
+        help="Write the per-stage metrics of the run to this JSON file.",
+    )(command)
+    return command
+
+
+def iter_until_deadline(results: Iterable[dict], run: Dict) -> Iterator[dict]:
+    """Yield `results` until the run deadline, then flag the run as partial."""
+    from ..deadline import DeadlineExceeded
+
+    try:
+        yield from results
+    except DeadlineExceeded as e:
+        click.echo(f"{e}, sending the results received so far!", err=True)
+        run["partial"] = True
+
+
+def send_newsletters(
+    newsletters: List[Dict],
+    strategy: str,
+    sort: str = "newest",
+    summary: Optional[str] = None,
+) -> List[str]:
+    """Send `newsletters` from one catalogue fetch, return the failed targets.
+
+    The documents are fetched once for the union of all subjects, then
+    routed locally to every newsletter whose subjects they match. With a
+    ledger (LEDGER_PATH), the fetch starts from the oldest watermark of the
+    targets, the documents already sent are skipped and an unchanged
+    notification is not sent again.
+
+    The run has RUN_DEADLINE seconds. When the catalogue runs out of time,
+    the notifications list the results received so far (DEADLINE_POLICY
+    partial), or the run fails (fail).
+    """
+    from ..deadline import DeadlineExceeded, run_deadline
+
+    with run_deadline():
+        try:
+            return _send_newsletters(newsletters, strategy, sort, summary)
+        except DeadlineExceeded as e:
+            raise click.ClickException(str(e))
+
+
+def _send_newsletters(
+    newsletters: List[Dict], strategy: str, sort: str, summary: Optional[str]
+) -> List[str]:
+    from ..deadline import get_deadline_policy
+    from ..ledger import get_digest, get_ledger
+
+    run = {"partial": False}
+    partial_allowed = get_deadline_policy() == "partial"
+    ledger = get_ledger()
+    targets = [newsletter["target"] for newsletter in newsletters]
+    window = window_end = None
+    if ledger:
+        window_start, window_end = ledger.get_window(targets)
+        if window_start > window_end:
+            click.echo(f"Nothing new since the last notifications! {targets}")
+            return []
+        window = get_date_range(window_start, window_end)
+
+    all_subjects = list(
+        iter_unique(subject for n in newsletters for subject in n["subjects"])
+    )
+    results = iter_newsletter_results(all_subjects, strategy, window)
+    if results is None:
+        click.echo("No updates in the backoffice!")
+        for target in targets if ledger else []:
+            ledger.record(target, window_end)
+        return []
+
+    if partial_allowed:
+        results = iter_until_deadline(results, run)
+    if len(newsletters) == 1:
+        # the catalogue filtered the subjects already, keep streaming
+        results_by_newsletter = {0: results}
+    else:
+        matcher = SubjectMatcher(
+            {
+                index: newsletter["subjects"]
+                for index, newsletter in enumerate(newsletters)
+            }
+        )
+        results_by_newsletter = matcher.route(results)
+
+    notifications, listed = [], {}
+    for index, newsletter in enumerate(newsletters):
+        target = newsletter["target"]
+        newsletter_results = results_by_newsletter.get(index, [])
+        if ledger:
+            newsletter_results = ledger.iter_unsent(target, newsletter_results)
+        listed[target] = []
+        message = render_newsletter(
+            newsletter_results,
+            list(newsletter["subjects"]),
+            newsletter["title"],
+            sort,
+            window,
+            listed[target],
+        )
+        if message is None:
+            continue
+        if ledger and ledger.get_digest(target) == get_digest(message):
+            click.echo(f"Notification to {target} unchanged, not sent again!")
+            continue
+        notifications.append((target, message))
+
+    failed = send_notifications(notifications, summary)
+    if ledger:
+        # a partial run is caught up by the next one, skipping what was sent
+        watermark = None if run["partial"] else window_end
+        digests = {target: get_digest(message) for target, message in notifications}
+        for target in targets:
+            if target not in failed:
+                ledger.record(target, watermark, listed[target], digests.get(target))
+    return failed
+
+
+def sort_option(command):
+    return click.option(
+        "--sort",
+        type=click.Choice(list(SORT_KEYS)),
+        default="newest",
+        show_default=True,
+        help="Order of the results listed, up to MAX_NOTIFICATION_RESULTS_COUNT.",
+    )(command)
+
+
+def summary_option(command):
+    return click.option(
+        "--summary",
+        type=click.Path(dir_okay=False, writable=True),
+        help="Write the per-target notification results to this JSON file.",
+    )(command)
+
 
 @click.command()
 @click.option(
@@ -35,7 +391,24 @@ logger = logging.getLogger(__name__)
     required=True,
     help="Egroup identifier. For eg. --target 'library-newsletter-notif-it'",
 )
-def cli(subjects: Tuple[str, ...], title: str, target: str) -> None:
+@strategy_option
+@sort_option
+@summary_option
+@cache_options
+@recording_options
+@metrics_options
+def cli(
+    subjects: Tuple[str, ...],
+    title: str,
+    target: str,
+    strategy: str,
+    sort: str,
+    summary: Optional[str],
+    no_cache: bool,
+    purge_cache: bool,
+    record: Optional[str],
+    replay: Optional[str],
+) -> None:
     """A CLI command to send notifications for library updates.
 
     The created range is last 7 days from running the job.
@@ -46,31 +419,216 @@ def cli(subjects: Tuple[str, ...], title: str, target: str) -> None:
         --title 'Administration/Management'
         --target 'library-newsletter-notif-admin-management'
     """
-    latest_pids = get_backoffice_latest_pids()
-    if not latest_pids:
-        click.echo("No updates in the backoffice!")
-        return
+    configure_http(no_cache, purge_cache, record, replay)
+    newsletter = {"subjects": list(subjects), "title": title, "target": target}
+    send_newsletters([newsletter], strategy, sort, summary)
 
-    results, query = get_results_from_pids(latest_pids, list(subjects))
-    if not results:
-        click.echo(f"No results visible in the catalogue! {subjects}")
+
+@click.command()
+@click.option(
+    "--config",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+    help="JSON file listing the newsletters. For eg. --config newsletters.json",
+)
+@strategy_option
+@sort_option
+@summary_option
+@cache_options
+@recording_options
+@metrics_options
+def batch(
+    config: str,
+    strategy: str,
+    sort: str,
+    summary: Optional[str],
+    no_cache: bool,
+    purge_cache: bool,
+    record: Optional[str],
+    replay: Optional[str],
+) -> None:
+    """A CLI command to send every configured newsletter from one catalogue fetch.
+
+    The documents are fetched once for the union of all subjects, then
+    routed locally to every newsletter whose subjects they match.
+
+    python -m src.cli newsletter-batch --config newsletters.json
+    """
+    configure_http(no_cache, purge_cache, record, replay)
+    newsletters = load_newsletters_config(config)
+    if not newsletters:
+        click.echo(f"No newsletters configured in {config}!")
         return
 
-    message = create_channel_message(results, title)
+    failed = send_newsletters(newsletters, strategy, sort, summary)
+    if failed:
+        raise click.ClickException(f"Notification failed for: {', '.join(failed)}")
+
+
+@click.command()
+@click.option(
+    "--config",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+    help="JSON file listing the newsletters, each with an optional cron "
+    "`schedule`. For eg. --config newsletters.json",
+)
+@click.option(
+    "--schedule",
+    default="0 8 * * 1",
+    show_default=True,
+    help="Cron schedule of the newsletters without their own.",
+)
+@click.option(
+    "--max-jobs",
+    type=click.IntRange(min=1),
+    default=2,
+    show_default=True,
+    help="Scheduled runs sent at the same time, at most.",
+)
+@click.option("--host", default="0.0.0.0", show_default=True)
+@click.option(
+    "--port",
+    type=int,
+    default=8080,
+    show_default=True,
+    help="Port of the /health and /metrics endpoints.",
+)
+@strategy_option
+@sort_option
+def serve(
+    config: str,
+    schedule: str,
+    max_jobs: int,
+    host: str,
+    port: int,
+    strategy: str,
+    sort: str,
+) -> None:
+    """A CLI command sending the newsletters on their schedules until stopped.
+
+    The process stays up between runs, keeping the HTTP connections and the
+    response cache warm. The newsletters due at the same time are sent from
+    one catalogue fetch.
+
+    python -m src.cli serve --config newsletters.json --port 8080
+    """
+    from ..scheduler import ScheduleError, Scheduler, get_jobs, start_status_server
+
+    newsletters = load_newsletters_config(config)
+    if not newsletters:
+        raise click.ClickException(f"No newsletters configured in {config}!")
+    try:
+        jobs = get_jobs(newsletters, schedule)
+    except ScheduleError as e:
+        raise click.ClickException(str(e))
+
+    configure_http(no_cache=False, purge_cache=False, record=None, replay=None)
+    scheduler = Scheduler(
+        jobs, lambda due: send_newsletters(due, strategy, sort), max_jobs
+    )
+    for job in jobs:
+        targets = ", ".join(newsletter["target"] for newsletter in job.newsletters)
+        click.echo(f"Scheduled {job.name} (next {job.next_run}): {targets}")
+
+    status_server = start_status_server(scheduler, host, port)
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *args: scheduler.stop())
+    try:
+        scheduler.serve_forever()
+    finally:
+        status_server.shutdown()
+
+
+@click.command()
+@metrics_options
+def sync() -> None:
+    """A CLI command syncing the local document index (INDEX_PATH) up to yesterday.
+
+    Only the documents updated since the last sync and the documents of the
+    new items and eitems missing from the index are fetched.
+
+    python -m src.cli index-sync
+    """
+    from ..index import get_index, sync_index
+
+    configure_http(no_cache=False, purge_cache=False, record=None, replay=None)
+    index = get_index()
+    fetched = sync_index(index)
     click.echo(
-        f"Subject: {subjects} -  Title: {title} - Results: {len(results)} results."
+        f"Index synced up to {index.get_watermark()}: {fetched} documents "
+        f"fetched, {index.count()} indexed."
     )
-    response = send_channel_request(message, target)
-    if response.status_code == 200:
-        click.echo("Notification sent successfully!")
-    else:
-        logger.error(
-            f"Notification failed with status code: {response.status_code}:{response.text}"
-        )
-        click.echo(
-            f"Notification failed with status code: {response.status_code}:{response.text}",
-            err=True,
-        )
+
+
+@click.command()
+@click.option(
+    "--subjects",
+    type=click.STRING,
+    multiple=True,
+    required=True,
+    help="Subjects domain. For eg. --subjects 005*:UDC --subjects 65*:",
+)
+@click.option(
+    "--title",
+    type=click.STRING,
+    required=True,
+    help="Subject title. For eg. --title 'Information Technology'",
+)
+@click.option(
+    "--since",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="First day of the digest, monday of last week by default.",
+)
+@click.option(
+    "--until",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Last day of the digest, sunday of last week by default.",
+)
+@click.option(
+    "--no-sync",
+    is_flag=True,
+    help="Query the index as it is, without asking the catalogue.",
+)
+@sort_option
+def preview(
+    subjects: Tuple[str, ...],
+    title: str,
+    since: Optional[datetime],
+    until: Optional[datetime],
+    no_sync: bool,
+    sort: str,
+) -> None:
+    """A CLI command printing a digest from the local document index, not sent.
+
+    Previews a newsletter, or an ad-hoc digest for a new e-group, from the
+    documents that got items or eitems in the period.
+
+    python -m src.cli preview --subjects "005*:UDC" --title 'Information Technology'
+        --since 2024-01-01
+    """
+    from ..index import get_index, sync_index
+
+    last_week_start, last_week_end = get_window_dates()
+    start = since.date() if since else last_week_start
+    end = until.date() if until else last_week_end
+    if start > end:
+        raise click.BadParameter("--since is after --until.")
+
+    index = get_index()
+    if not no_sync:
+        configure_http(no_cache=False, purge_cache=False, record=None, replay=None)
+        sync_index(index, min(end, get_today() - timedelta(days=1)))
+    window = get_date_range(start, end)
+    message = render_newsletter(
+        index.iter_documents(list(subjects), start, end),
+        list(subjects),
+        title,
+        sort,
+        window,
+    )
+    if message is not None:
+        click.echo(message)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+"""Module recording and replaying the http traffic of a run.
+
+A recording directory holds `exchanges.jsonl`, one catalogue or
+notification exchange per line, and `manifest.json` with the date of the
+run. Replaying it serves the responses back without the network, the run
+pinned to the recorded date so that it sends the same queries, and without
+the ledger so that it does not record the replayed notifications as sent.
+Request headers (tokens) are not recorded.
+"""
+
+import json
+import os
+import threading
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from typing import Optional
+
+from requests import Response, exceptions
+from requests.adapters import BaseAdapter
+
+from .cache import get_cache_key
+from .client import get_session
+from .env import settings
+from .ledger import close_ledger
+from .utils import get_today
+
+EXCHANGES_FILE = "exchanges.jsonl"
+MANIFEST_FILE = "manifest.json"
+
+# response headers kept, the others are dropped
+RECORDED_HEADERS = ("Content-Type", "Retry-After")
+
+
+def get_exchange_key(method: str, url: str) -> str:
+    return get_cache_key(url, method)
+
+
+class RecordingAdapter(BaseAdapter):
+    """Transport adapter sending through `adapter` and saving every exchange."""
+
+    def __init__(self, adapter: BaseAdapter, directory: str) -> None:
+        super().__init__()
+        self.adapter = adapter
+        self.path = os.path.join(directory, EXCHANGES_FILE)
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        response = self.adapter.send(request, **kwargs)
+        body = request.body
+        exchange = {
+            "method": request.method,
+            "url": request.url,
+            "request_body": body.decode() if isinstance(body, bytes) else body,
+            "status_code": response.status_code,
+            "headers": {
+                name: response.headers[name]
+                for name in RECORDED_HEADERS
+                if name in response.headers
+            },
+            "body": response.content.decode(response.encoding or "utf-8"),
+        }
+        with self._lock, open(self.path, "a") as exchanges_file:
+            exchanges_file.write(json.dumps(exchange) + "\n")
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """Transport adapter answering with the exchanges recorded in `directory`.
+
+    The responses of a request sent several times are replayed in the
+    recorded order, the last one repeated. A request never recorded fails
+    like an unreachable server.
+    """
+
+    def __init__(self, directory: str) -> None:
+        super().__init__()
+        self._exchanges = defaultdict(deque)
+        self._lock = threading.Lock()
+        with open(os.path.join(directory, EXCHANGES_FILE)) as exchanges_file:
+            for line in exchanges_file:
+                exchange = json.loads(line)
+                key = get_exchange_key(exchange["method"], exchange["url"])
+                self._exchanges[key].append(exchange)
+
+    def send(self, request, **kwargs):
+        key = get_exchange_key(request.method, request.url)
+        with self._lock:
+            exchanges = self._exchanges.get(key)
+            if not exchanges:
+                raise exceptions.ConnectionError(
+                    f"No recorded response for {key}", request=request
+                )
+            exchange = exchanges.popleft() if len(exchanges) > 1 else exchanges[0]
+
+        response = Response()
+        response.status_code = exchange["status_code"]
+        response.url = request.url
+        response.request = request
+        response.headers.update(exchange["headers"])
+        response._content = exchange["body"].encode()
+        response.encoding = "utf-8"
+        return response
+
+    def close(self):
+        pass
+
+
+def configure_recording(
+    record_dir: Optional[str] = None, replay_dir: Optional[str] = None
+) -> None:
+    """Record the traffic of the shared session to `record_dir`, or replay it
+    from `replay_dir`.
+    """
+    session = get_session()
+    if record_dir:
+        os.makedirs(record_dir, exist_ok=True)
+        open(os.path.join(record_dir, EXCHANGES_FILE), "w").close()
+        manifest = {
+            "date": get_today().isoformat(),
+            "recorded": datetime.now(timezone.utc).isoformat(),
+        }
+        with open(os.path.join(record_dir, MANIFEST_FILE), "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        # the same pooled adapter serves both schemes
+        adapter = RecordingAdapter(session.get_adapter("https://"), record_dir)
+        for prefix in ("https://", "http://"):
+            session.mount(prefix, adapter)
+
+    elif replay_dir:
+        with open(os.path.join(replay_dir, MANIFEST_FILE)) as manifest_file:
+            manifest = json.load(manifest_file)
+        # send the queries of the recorded week
+        settings.NEWSLETTER_DATE = manifest["date"]
+        settings.LEDGER_PATH = ""
+        close_ledger()
+        adapter = ReplayAdapter(replay_dir)
+        for prefix in ("https://", "http://"):
+            session.mount(prefix, adapter)
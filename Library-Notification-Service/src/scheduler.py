@@ -0,0 +1,314 @@
+"""Module running the newsletters on cron-like schedules in a resident process."""
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Set
+
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# field: (first, last)
+CRON_FIELDS = {
+    "minute": (0, 59),
+    "hour": (0, 23),
+    "day": (1, 31),
+    "month": (1, 12),
+    "weekday": (0, 7),
+}
+
+
+class ScheduleError(ValueError):
+    pass
+
+
+def parse_cron_field(field: str, first: int, last: int) -> Set[int]:
+    """Return the values of a cron field: `*`, `5`, `1-5`, `*/15`, `1,3-5`..."""
+    values = set()
+    for part in field.split(","):
+        part_range, _, step = part.partition("/")
+        try:
+            step = int(step) if step else 1
+            if part_range == "*":
+                start, end = first, last
+            elif "-" in part_range:
+                start, end = (int(value) for value in part_range.split("-", 1))
+            else:
+                start = end = int(part_range)
+                if step != 1:
+                    end = last
+        except ValueError:
+            raise ScheduleError(f"Invalid cron field: {field!r}")
+        if not first <= start <= end <= last or step < 1:
+            raise ScheduleError(f"Invalid cron field: {field!r}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """Standard 5 fields cron expression: minute hour day month weekday.
+
+    Like cron, when both the day and the weekday are restricted, either
+    of them matching is enough. Weekday 0 and 7 are Sunday.
+    """
+
+    def __init__(self, expression: str) -> None:
+        fields = expression.split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ScheduleError(f"Invalid cron expression: {expression!r}")
+        self.expression = expression
+        (
+            self.minutes,
+            self.hours,
+            self.days,
+            self.months,
+            weekdays,
+        ) = (
+            parse_cron_field(field, *CRON_FIELDS[name])
+            for field, name in zip(fields, CRON_FIELDS)
+        )
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def matches_day(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Return the first matching minute strictly after `moment`."""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                month_start = moment.replace(day=1, hour=0, minute=0)
+                moment = (month_start + timedelta(days=32)).replace(day=1)
+            elif not self.matches_day(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ScheduleError(f"{self.expression!r} never matches")
+
+
+class Job:
+    """Newsletters sharing a schedule, sent together from one catalogue fetch."""
+
+    def __init__(self, schedule: CronSchedule, newsletters: List[Dict]) -> None:
+        self.schedule = schedule
+        self.newsletters = newsletters
+        self.next_run: Optional[datetime] = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.last_run: Optional[datetime] = None
+        self.last_success: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.last_duration = 0.0
+
+    @property
+    def name(self) -> str:
+        return self.schedule.expression
+
+    def to_dict(self) -> Dict:
+        def isoformat(moment):
+            return moment.isoformat() if moment else None
+
+        return {
+            "schedule": self.name,
+            "targets": [newsletter["target"] for newsletter in self.newsletters],
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "next_run": isoformat(self.next_run),
+            "last_run": isoformat(self.last_run),
+            "last_success": isoformat(self.last_success),
+            "last_error": self.last_error,
+            "last_duration": self.last_duration,
+        }
+
+
+def get_jobs(newsletters: List[Dict], default_schedule: str) -> List[Job]:
+    """Group the newsletters by schedule, one job per schedule."""
+    jobs = {}
+    for newsletter in newsletters:
+        expression = " ".join(newsletter.get("schedule", default_schedule).split())
+        if expression not in jobs:
+            jobs[expression] = Job(CronSchedule(expression), [])
+        jobs[expression].newsletters.append(newsletter)
+    return list(jobs.values())
+
+
+class Scheduler:
+    """Run the due jobs on a pool of at most `max_jobs` threads.
+
+    `run_job(newsletters)` sends the newsletters and returns the failed
+    targets.
+    """
+
+    def __init__(
+        self,
+        jobs: List[Job],
+        run_job: Callable[[List[Dict]], List[str]],
+        max_jobs: int = 1,
+        clock: Callable[[], datetime] = datetime.now,
+    ) -> None:
+        self.jobs = jobs
+        self.run_job = run_job
+        self.clock = clock
+        self.started = clock()
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        for job in jobs:
+            job.next_run = job.schedule.next_after(self.started)
+
+    def _run(self, jobs: List[Job], started: datetime) -> None:
+        newsletters = [newsletter for job in jobs for newsletter in job.newsletters]
+        start = time.perf_counter()
+        try:
+            failed = set(self.run_job(newsletters))
+            errors = {}
+            for job in jobs:
+                targets = [
+                    n["target"] for n in job.newsletters if n["target"] in failed
+                ]
+                if targets:
+                    errors[job] = f"Notification failed for: {', '.join(targets)}"
+        except Exception as e:
+            logger.exception(f"Newsletters {[job.name for job in jobs]} failed")
+            errors = {job: str(e) or type(e).__name__ for job in jobs}
+
+        duration = time.perf_counter() - start
+        with self._lock:
+            for job in jobs:
+                job.running = False
+                job.runs += 1
+                job.last_run = started
+                job.last_duration = duration
+                if job in errors:
+                    job.failures += 1
+                    job.last_error = errors[job]
+                else:
+                    job.last_success = started
+                    job.last_error = None
+
+    def run_pending(self) -> List[Job]:
+        """Start the due jobs, return them.
+
+        The jobs due at the same time run together, from one catalogue fetch.
+        A job still running when due again is skipped.
+        """
+        now = self.clock()
+        due = []
+        with self._lock:
+            for job in self.jobs:
+                if job.next_run > now:
+                    continue
+                job.next_run = job.schedule.next_after(now)
+                if job.running:
+                    logger.warning(f"Newsletters {job.name} still running, skipped")
+                    continue
+                job.running = True
+                due.append(job)
+        if due:
+            self._executor.submit(self._run, due, now)
+        return due
+
+    def serve_forever(self, poll_interval: float = 30.0) -> None:
+        """Run the jobs until `stop`, then wait for the running ones."""
+        try:
+            while not self._stop.is_set():
+                self.run_pending()
+                next_run = min(job.next_run for job in self.jobs)
+                wait = (next_run - self.clock()).total_seconds()
+                self._stop.wait(min(max(wait, 0.0), poll_interval))
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                "started": self.started.isoformat(),
+                "jobs": [job.to_dict() for job in self.jobs],
+            }
+
+    def to_prometheus(self) -> str:
+        """Return the stage counters of all the runs since the scheduler
+        started, and the state of every job, in the Prometheus text format.
+        """
+        lines = [get_metrics().to_prometheus(cumulative=True).rstrip("\n")]
+        gauges = {
+            "runs": "Runs of the scheduled job.",
+            "failures": "Failed runs of the scheduled job.",
+            "running": "1 while the scheduled job runs.",
+            "last_duration_seconds": "Wall time of the last run.",
+            "last_success_timestamp_seconds": "Unix time of the last successful run.",
+        }
+        with self._lock:
+            values = {
+                job.name: {
+                    "runs": job.runs,
+                    "failures": job.failures,
+                    "running": int(job.running),
+                    "last_duration_seconds": job.last_duration,
+                    "last_success_timestamp_seconds": (
+                        job.last_success.timestamp() if job.last_success else 0
+                    ),
+                }
+                for job in self.jobs
+            }
+        for name, help_text in gauges.items():
+            metric = f"lns_scheduler_job_{name}"
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+            for job_name, job_values in values.items():
+                lines.append(f'{metric}{{schedule="{job_name}"}} {job_values[name]:g}')
+        return "\n".join(lines) + "\n"
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    """`/health` answers the scheduler status as json, `/metrics` as Prometheus."""
+
+    def do_GET(self):
+        scheduler = self.server.scheduler
+        if self.path == "/health":
+            body = json.dumps({"status": "ok", **scheduler.status()}).encode()
+            content_type = "application/json"
+        elif self.path == "/metrics":
+            body = scheduler.to_prometheus().encode()
+            content_type = "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def start_status_server(scheduler: Scheduler, host: str, port: int):
+    """Serve the scheduler `/health` and `/metrics` in a background thread."""
+    server = ThreadingHTTPServer((host, port), StatusHandler)
+    server.daemon_threads = True
+    server.scheduler = scheduler
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,86 @@
+"""Module matching catalogue documents against subjects filters locally."""
+
+from fnmatch import fnmatchcase
+from typing import Dict, Hashable, Iterable, List, Set
+
+WILDCARDS = "*?"
+
+# trie keys of the terms ending at a node, distinct from any character
+_PREFIX = ("*",)
+_EXACT = ("",)
+
+
+class SubjectMatcher:
+    """Route documents to every subjects filter they match.
+
+    `filters` maps a key (e.g. a newsletter target) to subjects in the
+    `value:scheme` format of `get_subject_query`, and a document matches a
+    key exactly when the catalogue would return it for that subjects query:
+
+    - a value ending with `*` is a prefix, other wildcards fall back to
+      `fnmatchcase`, values without wildcards match exactly (keyword field);
+    - as in the catalogue index the subjects are flattened, so `005*:UDC`
+      matches a document with one subject value starting with `005` and one
+      subject, possibly another, with the `UDC` scheme.
+
+    Prefixes and exact values are compiled into a trie, so a subject value
+    is matched against all filters in a single walk.
+    """
+
+    def __init__(self, filters: Dict[Hashable, List[str]]) -> None:
+        self._trie = {}
+        self._patterns = []
+        # every (value, scheme) term gets an index, kept with its keys
+        self._terms = []
+        for key, subjects in filters.items():
+            for subject in subjects:
+                value, scheme = subject.split(":")
+                term = len(self._terms)
+                self._terms.append((key, scheme))
+                self._compile(value, term)
+
+    def _compile(self, value: str, term: int) -> None:
+        prefix = value[:-1] if value.endswith("*") else value
+        if any(wildcard in prefix for wildcard in WILDCARDS):
+            self._patterns.append((value, term))
+            return
+
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        terminal = _PREFIX if value.endswith("*") else _EXACT
+        node.setdefault(terminal, []).append(term)
+
+    def _match_value(self, value: str) -> Iterable[int]:
+        node = self._trie
+        for char in value:
+            yield from node.get(_PREFIX, [])
+            if (node := node.get(char)) is None:
+                break
+        else:
+            yield from node.get(_PREFIX, [])
+            yield from node.get(_EXACT, [])
+
+        for pattern, term in self._patterns:
+            if fnmatchcase(value, pattern):
+                yield term
+
+    def match(self, document: dict) -> Set[Hashable]:
+        """Return the keys of the filters matching `document`."""
+        subjects = document.get("metadata", {}).get("subjects") or []
+        schemes = {subject.get("scheme") for subject in subjects}
+        keys = set()
+        for subject in subjects:
+            for term in self._match_value(subject.get("value") or ""):
+                key, scheme = self._terms[term]
+                if not scheme or scheme in schemes:
+                    keys.add(key)
+        return keys
+
+    def route(self, documents: Iterable[dict]) -> Dict[Hashable, List[dict]]:
+        """Group `documents` by the keys they match, keeping their order."""
+        routed = {key: [] for key, scheme in self._terms}
+        for document in documents:
+            for key in self.match(document):
+                routed[key].append(document)
+        return routed
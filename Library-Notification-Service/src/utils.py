@@ -1,10 +1,12 @@
 """Module containing methods related to query generator."""
 
+import heapq
 import urllib.parse
-from datetime import datetime, timedelta
-from typing import List, Optional
+from datetime import date, datetime, timedelta
+from typing import Iterable, Iterator, List, Optional, Tuple
 
-from .env import LIBRARY_CATALOGUE_SITE_URL
+from .env import ConfigurationError, settings
+from .metrics import increment, timed_stage
 
 
 def get_full_query(
@@ -35,6 +37,22 @@ def get_full_query(
     return get_and_join(fields)
 
 
+def get_latest_subject_query(
+    subjects: List[str], window: Optional[List[str]] = None
+) -> str:
+    """Query of the documents in `subjects` created or updated in `window`.
+
+    `window` defaults to last week.
+    """
+    window = window or get_last_week_date_range()
+    window_query = get_or_join(
+        [get_range_query(window, "_created"), get_range_query(window, "_updated")]
+    )
+    return get_and_join(
+        [f"({window_query})", get_full_query(subject=subjects, restricted=False)]
+    )
+
+
 def get_or_join(queries: List[str]) -> str:
     return " OR ".join(queries)
 
@@ -43,12 +61,42 @@ def get_and_join(queries: List[str]) -> str:
     return " AND ".join(queries)
 
 
-def get_last_week_date_range() -> List[str]:
-    today = datetime.today().date()
+def get_today() -> date:
+    """Return today, or the NEWSLETTER_DATE the run is pinned to."""
+    if settings.NEWSLETTER_DATE:
+        try:
+            return date.fromisoformat(settings.NEWSLETTER_DATE)
+        except ValueError:
+            raise ConfigurationError(
+                f"Invalid environment variable NEWSLETTER_DATE: "
+                f"{settings.NEWSLETTER_DATE!r}"
+            )
+    return datetime.today().date()
+
+
+def get_last_week_dates() -> Tuple[date, date]:
+    """Return the first (monday) and last (sunday) days of last week."""
+    today = get_today()
     last_week_start = today - timedelta(days=today.weekday() + 7)
-    last_week_end = last_week_start + timedelta(days=6)
-    date_range = f"[{last_week_start.isoformat()}:{last_week_end.isoformat()}]"
-    return [date_range]
+    return last_week_start, last_week_start + timedelta(days=6)
+
+
+def get_date_range(start: date, end: date) -> List[str]:
+    return [f"[{start.isoformat()}:{end.isoformat()}]"]
+
+
+def get_last_week_date_range() -> List[str]:
+    return get_date_range(*get_last_week_dates())
+
+
+def get_window_dates(window: Optional[List[str]] = None) -> Tuple[date, date]:
+    """Return the first and last days of a `get_date_range` window, last week
+    by default.
+    """
+    if not window:
+        return get_last_week_dates()
+    start, end = window[0].strip("[]").split(":")
+    return date.fromisoformat(start), date.fromisoformat(end)
 
 
 def get_last_five_years_range() -> List[str]:
@@ -76,7 +124,7 @@ def get_subject_query(subjects: List[str]) -> str:
         subject_value, subject_scheme = subject.split(":")
         if subject_scheme:
             subject_queries.append(
-                f"(subjects.value:{subject_value} AND subject.scheme:{subject_scheme})"
+                f"(subjects.value:{subject_value} AND subjects.scheme:{subject_scheme})"
             )
         else:
             subject_queries.append(f"subjects.value:{subject_value}")
@@ -99,15 +147,105 @@ def get_pids_from_docs(docs: List[dict]) -> List[str]:
     return pids
 
 
-def create_channel_message(message: List[dict], title: str) -> str:
-    html_string = f"<h4>Latest books/e-books for {title}</h4>\n<ul>\n"
+def project_document(doc: dict) -> dict:
+    """Keep only the fields of a literature record the newsletters use.
+
+    The id and created date (sorting), the title (rendering), the
+    subjects (routing) and the restricted flag (document index). The
+    records are much larger, mostly abstracts and authors, and the results
+    are kept until every newsletter is rendered.
+    """
+    metadata = doc.get("metadata", {})
+    projected = {"id": doc.get("id"), "metadata": {}}
+    if "created" in doc:
+        projected["created"] = doc["created"]
+    if "title" in metadata:
+        projected["metadata"]["title"] = metadata["title"]
+    if "subjects" in metadata:
+        projected["metadata"]["subjects"] = [
+            {"value": subject.get("value"), "scheme": subject.get("scheme")}
+            for subject in metadata["subjects"] or []
+        ]
+    if metadata.get("restricted"):
+        projected["metadata"]["restricted"] = True
+    return projected
+
+
+def iter_unique(items: Iterable) -> Iterator:
+    """Yield the first occurrence of every item, keeping their order."""
+    seen = set()
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            yield item
+
+
+class CountingIterator:
+    """Iterator wrapper keeping the number of items consumed in `count`."""
+
+    def __init__(self, iterable: Iterable) -> None:
+        self._iterator = iter(iterable)
+        self.count = 0
+
+    def __iter__(self) -> "CountingIterator":
+        return self
+
+    def __next__(self):
+        item = next(self._iterator)
+        self.count += 1
+        return item
+
+
+# sort name: (key, descending)
+SORT_KEYS = {
+    "newest": (lambda doc: doc.get("created") or "", True),
+    "title": (lambda doc: (doc.get("metadata", {}).get("title") or "").lower(), False),
+}
+
+
+def select_top_results(
+    results: Iterable[dict], count: int, sort: str = "newest"
+) -> Tuple[List[dict], int]:
+    """Return the first `count` results in `sort` order, and the total results.
+
+    Only `count` results are kept at a time in a heap while consuming
+    `results`, ties keep their original order.
+    """
+    key, descending = SORT_KEYS[sort]
+    results = CountingIterator(results)
+    select = heapq.nlargest if descending else heapq.nsmallest
+    top_results = select(count, results, key=key)
+    return top_results, results.count
+
+
+@timed_stage("render")
+def create_channel_message(
+    message: Iterable[dict],
+    title: str,
+    more_count: int = 0,
+    more_url: str = "",
+    more_label: Optional[str] = None,
+) -> str:
+    """Render the notification body, linking `more_url` for `more_count` results.
+
+    With `more_label`, `more_url` is not the search of exactly these results
+    and is linked under that label instead.
+    """
+    parts = [f"<h4>Latest books/e-books for {title}</h4>\n<ul>\n"]
     for doc in message:
         doc_id = doc.get("id", "")
         if doc_id:
             doc_query = urllib.parse.quote(f"pid: {doc_id}")  # exact match
-            doc_url = f"{LIBRARY_CATALOGUE_SITE_URL}{doc_query}"
+            doc_url = f"{settings.LIBRARY_CATALOGUE_SITE_URL}{doc_query}"
             doc_title = doc.get("metadata", {}).get("title", "")
-            html_string += f"<li><a href='{doc_url}'>{doc_title}</a></li>\n"
-    html_string += "</ul>"
-
-    return html_string
+            parts.append(f"<li><a href='{doc_url}'>{doc_title}</a></li>\n")
+            increment("results", "render")
+    parts.append("</ul>")
+    if more_count > 0 and more_label:
+        parts.append(
+            f"\n<p>...and {more_count} more, see <a href='{more_url}'>{more_label}</a></p>"
+        )
+    elif more_count > 0:
+        parts.append(f"\n<p>...and <a href='{more_url}'>{more_count} more</a></p>")
+
+    return "".join(parts)
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+from requests import Response
+from requests.adapters import BaseAdapter
+
+TEST_ENV = {
+    "MAX_NOTIFICATION_RESULTS_COUNT": "20",
+    "LIBRARY_CATALOGUE_SITE_API": "https://catalogue.local/api/literature/?q=",
+    "LIBRARY_CATALOGUE_SITE_URL": "https://catalogue.local/search?q=",
+    "LIBRARY_CATALOGUE_BACKOFFICE_ITEMS_API": "https://catalogue.local/api/items/?q=",
+    "LIBRARY_CATALOGUE_BACKOFFICE_EITEMS_API": "https://catalogue.local/api/eitems/?q=",
+    "LIBRARY_CATALOGUE_BACKOFFICE_API_TOKEN": "backoffice-token",
+    "NOTIFICATIONS_API_URL": "https://notifications.local/api/notifications",
+    "NOTIFICATIONS_API_SECRET": "notifications-secret",
+    "NOTIFICATIONS_CHANNEL_ID": "channel-id",
+}
+
+
+@pytest.fixture
+def updated_env(monkeypatch):
+    from src.env import settings
+
+    for env_name, env_value in TEST_ENV.items():
+        monkeypatch.setenv(env_name, env_value)
+    settings.reset()
+    yield
+    settings.reset()
+
+
+@pytest.fixture
+def newsletter(updated_env):
+    from src.providers import library_newsletter
+
+    return library_newsletter
+
+
+class FakeAdapter(BaseAdapter):
+    """Transport adapter answering requests with `handler(request)`."""
+
+    def __init__(self, handler):
+        super().__init__()
+        self.handler = handler
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        status_code, body = self.handler(request)
+        response = Response()
+        response.status_code = status_code
+        response.url = request.url
+        response.request = request
+        response._content = json.dumps(body).encode()
+        response.headers["Content-Type"] = "application/json"
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_http(updated_env, monkeypatch):
+    """Route the shared session to a `FakeAdapter`, call it with a handler."""
+    from src import client
+
+    def mount(handler):
+        adapter = FakeAdapter(handler)
+        session = client.create_session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        monkeypatch.setattr(client, "_session", session)
+        return adapter
+
+    return mount
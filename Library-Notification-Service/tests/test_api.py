@@ -0,0 +1,224 @@
+import re
+import threading
+import time
+import urllib.parse
+
+import pytest
+from src import api
+
+
+def backoffice_page(pids, next_url=None):
+    return {
+        "hits": {
+            "hits": [{"metadata": {"document_pid": pid}} for pid in pids],
+            "total": len(pids),
+        },
+        "links": {"next": next_url} if next_url else {},
+    }
+
+
+def test_get_backoffice_latest_pids_follows_pagination(fake_http):
+    def handler(request):
+        if "/api/items/" in request.url and "page=2" not in request.url:
+            return 200, backoffice_page(
+                ["1", "2"], "https://catalogue.local/api/items/?page=2"
+            )
+        if "/api/items/" in request.url:
+            return 200, backoffice_page(["3"])
+        return 200, backoffice_page(["4"])
+
+    adapter = fake_http(handler)
+
+    assert api.get_backoffice_latest_pids() == ["1", "2", "3", "4"]
+    assert len(adapter.requests) == 3
+    assert all(
+        request.headers["Authorization"] == "Bearer backoffice-token"
+        for request in adapter.requests
+    )
+
+
+def test_get_backoffice_latest_pids_raises_on_error(fake_http):
+    fake_http(lambda request: (404, {}))
+
+    with pytest.raises(Exception, match="Request failed with status code"):
+        api.get_backoffice_latest_pids()
+
+
+def test_get_backoffice_latest_pids_stops_downloads_on_error(fake_http):
+    pages = api.BACKOFFICE_PREFETCH_PAGES * 3
+    eitems_queue_full = threading.Event()
+
+    def handler(request):
+        if "/api/items/" in request.url:
+            eitems_queue_full.wait(timeout=5)
+            return 404, {}
+        page = int(request.url.split("page=")[1]) if "page=" in request.url else 1
+        if page > api.BACKOFFICE_PREFETCH_PAGES:
+            eitems_queue_full.set()
+        next_url = f"https://catalogue.local/api/eitems/?page={page + 1}"
+        return 200, backoffice_page([str(page)], next_url if page < pages else None)
+
+    fake_http(handler)
+    errors = []
+
+    def run():
+        try:
+            api.get_backoffice_latest_pids()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert "Request failed with status code" in str(errors[0])
+
+
+def test_get_results_from_pids_reuses_session(fake_http):
+    def handler(request):
+        pids = re.findall(r"pid: (\w+)", urllib.parse.unquote(request.url))
+        hits = [{"id": pid, "metadata": {"title": pid}} for pid in pids]
+        return 200, {"hits": {"hits": hits, "total": len(hits)}}
+
+    adapter = fake_http(handler)
+    pids = [str(pid) for pid in range(45)]
+
+    results, queries = api.get_results_from_pids(pids, ["53*:"], max_url_bytes=500)
+
+    assert [result["id"] for result in results] == pids
+    assert len(adapter.requests) == len(queries) > 1
+
+
+def test_get_results_from_pids_keeps_chunk_order(fake_http):
+    def handler(request):
+        pids = re.findall(r"pid: (\w+)", urllib.parse.unquote(request.url))
+        # answer the first chunks last
+        time.sleep(0.05 if pids[0] == "0" else 0)
+        hits = [{"id": pid, "metadata": {"title": pid}} for pid in pids]
+        return 200, {"hits": {"hits": hits, "total": len(hits)}}
+
+    fake_http(handler)
+    pids = [str(pid) for pid in range(200)]
+
+    results, queries = api.get_results_from_pids(
+        pids, ["53*:"], max_workers=5, max_url_bytes=800
+    )
+
+    assert [result["id"] for result in results] == pids
+    assert queries == [
+        api.get_full_query(pid=chunk, subject=["53*:"])
+        for chunk in api.iter_pid_chunks(pids, ["53*:"], 800)
+    ]
+
+
+def test_iter_pid_chunks_dedupes_and_fits_url_budget(updated_env):
+    pids = [str(pid) for pid in range(1000)] * 2
+    subjects = ["005*:UDC", "65*:"]
+
+    chunks = list(api.iter_pid_chunks(pids, subjects, max_url_bytes=2000))
+
+    assert [pid for chunk in chunks for pid in chunk] == pids[:1000]
+    for chunk in chunks:
+        url = api.get_api_url(api.get_full_query(pid=chunk, subject=subjects), 99999)
+        assert len(url) <= 2000
+    # the budget is filled: the next pid would not have fit
+    for chunk, next_chunk in zip(chunks, chunks[1:]):
+        query = api.get_full_query(pid=chunk + next_chunk[:1], subject=subjects)
+        assert len(api.get_api_url(query, 99999)) > 2000
+
+
+def test_iter_pid_chunks_yields_oversized_pid_alone(updated_env):
+    chunks = list(api.iter_pid_chunks(["1", "x" * 200, "2"], [], max_url_bytes=100))
+
+    assert chunks == [["1"], ["x" * 200], ["2"]]
+
+
+def test_get_backoffice_latest_pids_negotiates_page_size(fake_http):
+    def handler(request):
+        size = re.search(r"size=(\d+)", request.url)
+        if size and int(size.group(1)) > 50:
+            return 400, {"message": "Maximum number of results exceeded"}
+        pid = "item" if "/api/items/" in request.url else "eitem"
+        return 200, backoffice_page([pid])
+
+    adapter = fake_http(handler)
+
+    assert api.get_backoffice_latest_pids(page_size=200) == ["item", "eitem"]
+    sizes = sorted(re.search(r"size=(\d+)", r.url).group(1) for r in adapter.requests)
+    assert sizes == ["100", "100", "200", "200", "50", "50"]
+
+
+def test_iter_results_from_pids_overlaps_with_pid_production(fake_http):
+    first_lookup = threading.Event()
+
+    def handler(request):
+        first_lookup.set()
+        pids = re.findall(r"pid: (\w+)", urllib.parse.unquote(request.url))
+        hits = [{"id": pid, "metadata": {"title": pid}} for pid in pids]
+        return 200, {"hits": {"hits": hits, "total": len(hits)}}
+
+    fake_http(handler)
+
+    pids = [str(pid) for pid in range(60)]
+    first_chunk = next(api.iter_pid_chunks(pids, ["53*:"], max_url_bytes=800))
+
+    def produce_pids():
+        # the first chunk is complete once the next pid does not fit anymore
+        yield from pids[: len(first_chunk) + 1]
+        # it is looked up before the remaining pids are produced
+        assert first_lookup.wait(timeout=5)
+        yield from pids[len(first_chunk) + 1 :]
+
+    results = api.iter_results_from_pids(produce_pids(), ["53*:"], max_url_bytes=800)
+
+    assert [result["id"] for result in results] == pids
+
+
+def test_iter_latest_subject_docs_pushes_filters_down(fake_http):
+    def handler(request):
+        if "page=2" in request.url:
+            return 200, {"hits": {"hits": [{"id": "2"}], "total": 2}, "links": {}}
+        next_url = "https://catalogue.local/api/literature/?page=2"
+        return 200, {
+            "hits": {"hits": [{"id": "1"}], "total": 2},
+            "links": {"next": next_url},
+        }
+
+    adapter = fake_http(handler)
+
+    docs = list(api.iter_latest_subject_docs(["53*:"], page_size=1))
+
+    assert [doc["id"] for doc in docs] == ["1", "2"]
+    query = urllib.parse.unquote(adapter.requests[0].url)
+    assert "_created:" in query and "_updated:" in query
+    assert "subjects.value:53*" in query
+    assert "NOT restricted: true" in query
+    assert query.endswith("&size=1")
+
+
+def test_get_site_api_docs_keeps_only_used_fields(fake_http):
+    hit = {
+        "id": "1",
+        "created": "2024-01-09T10:00:00",
+        "metadata": {
+            "title": "Doc 1",
+            "abstract": "x" * 1000,
+            "authors": [{"full_name": "Author"}],
+            "subjects": [{"value": "539.1", "scheme": "UDC", "notes": "..."}],
+        },
+    }
+    fake_http(lambda request: (200, {"hits": {"hits": [hit], "total": 1}}))
+
+    docs = api.get_site_api_docs("pid: 1")
+
+    assert docs == [
+        {
+            "id": "1",
+            "created": "2024-01-09T10:00:00",
+            "metadata": {
+                "title": "Doc 1",
+                "subjects": [{"value": "539.1", "scheme": "UDC"}],
+            },
+        }
+    ]
@@ -0,0 +1,24 @@
+import math
+
+from benchmarks.newsletter import run_newsletter
+from benchmarks.stub_server import StubServer, generate_week
+
+
+def test_newsletter_benchmark_against_stub_server(updated_env, monkeypatch):
+    week = generate_week(documents=300, items=450, eitems=120, recent=0.5)
+    args = ["newsletter", "--subjects", "53*:", "--title", "Physics"]
+    args += ["--target", "physics", "--no-cache"]
+
+    with StubServer(week) as server:
+        for env_name, env_value in server.get_env().items():
+            monkeypatch.setenv(env_name, env_value)
+        monkeypatch.setenv("BACKOFFICE_PAGE_SIZE", "100")
+        run = run_newsletter(server, args)
+        notification = server.notifications[0]
+
+    assert run["endpoints"]["items"] == math.ceil(450 / 100)
+    assert run["endpoints"]["eitems"] == math.ceil(120 / 100)
+    assert run["endpoints"]["notifications"] == run["notifications"] == 1
+    assert run["received_bytes"] > 0 and run["sent_bytes"] > 0
+    assert run["peak_bytes"] > 0
+    assert notification["targetGroups"] == [{"groupIdentifier": "physics"}]
@@ -0,0 +1,58 @@
+from src import cache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_cache_key_normalises_query():
+    assert cache.get_cache_key(
+        "https://catalogue.local/api/literature/?q=pid%3A%20%201&size=10"
+    ) == cache.get_cache_key("https://catalogue.local/api/literature/?size=10&q=pid: 1")
+
+
+def test_response_cache_expires_after_ttl(tmp_path):
+    clock = Clock()
+    responses = cache.ResponseCache(str(tmp_path), ttl=60, clock=clock)
+
+    responses.set("key", b"body")
+    assert responses.get("key") == b"body"
+
+    clock.now += 61
+    assert responses.get("key") is None
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    clock = Clock()
+    responses = cache.ResponseCache(str(tmp_path), max_bytes=10, clock=clock)
+
+    responses.set("first", b"12345")
+    clock.now += 1
+    responses.set("second", b"12345")
+    clock.now += 1
+    responses.get("first")
+    clock.now += 1
+    responses.set("third", b"12345")
+
+    assert responses.get("first") == b"12345"
+    assert responses.get("second") is None
+    assert responses.get("third") == b"12345"
+
+
+def test_get_json_is_served_from_cache(fake_http, monkeypatch, tmp_path):
+    from src import client
+
+    monkeypatch.setattr(cache, "_cache", cache.ResponseCache(str(tmp_path)))
+    adapter = fake_http(lambda request: (200, {"hits": {"hits": [], "total": 0}}))
+    url = "https://catalogue.local/api/literature/?q=pid%3A%201"
+
+    assert client.get_json(url) == client.get_json(url)
+    assert len(adapter.requests) == 1
+
+    cache.get_cache().purge()
+    client.get_json(url)
+    assert len(adapter.requests) == 2
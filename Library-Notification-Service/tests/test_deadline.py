@@ -0,0 +1,140 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from click.testing import CliRunner
+
+# the results phase gets 80% of it
+RUN_DEADLINE = 2
+
+ARGS = [
+    "--subjects",
+    "53*:",
+    "--title",
+    "Physics",
+    "--target",
+    "physics",
+    "--strategy",
+    "pushdown",
+]
+
+
+def test_deadline_phases():
+    from src.deadline import Deadline, DeadlineExceeded
+
+    now = [100.0]
+    deadline = Deadline(10, clock=lambda: now[0])
+    assert deadline.get_remaining("backoffice") == 4
+    assert deadline.get_remaining("send") == 10
+
+    now[0] = 105.0
+    deadline.check("results")
+    with pytest.raises(DeadlineExceeded, match="during the backoffice phase"):
+        deadline.check("backoffice")
+
+
+def test_timeouts_capped_by_deadline(updated_env):
+    from src.deadline import get_timeout, run_deadline
+
+    assert get_timeout("backoffice") == (5.0, 30.0)
+    with run_deadline(10):
+        connect_timeout, read_timeout = get_timeout("backoffice")
+        assert 3.9 < connect_timeout <= 4
+        assert 3.9 < read_timeout <= 4
+    with run_deadline(100):
+        assert get_timeout("results") == (5.0, 30.0)
+
+
+class StalledCatalogueHandler(BaseHTTPRequestHandler):
+    """Catalogue serving a first page, then never answering the second one."""
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path, b""))
+        if "page=2" in self.path:
+            self.server.release.wait()
+            return
+        base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        hits = [{"id": "1", "metadata": {"title": "Doc 1"}}]
+        links = {"next": f"{base_url}/api/literature/?page=2"}
+        self.send_json({"hits": {"hits": hits, "total": 2}, "links": links})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append(("POST", self.path, body))
+        self.send_json({})
+
+    def send_json(self, body):
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stalled_catalogue(updated_env, monkeypatch):
+    """Stub catalogue server stalling on its second page, through the real
+    retrying session."""
+    from src import client
+    from src.env import settings
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StalledCatalogueHandler)
+    server.daemon_threads = True
+    server.requests, server.release = [], threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    for name, path in (
+        ("LIBRARY_CATALOGUE_SITE_API", "/api/literature/?q="),
+        ("NOTIFICATIONS_API_URL", "/api/notifications"),
+    ):
+        monkeypatch.setenv(name, f"{base_url}{path}")
+    monkeypatch.setenv("RUN_DEADLINE", str(RUN_DEADLINE))
+    settings.reset()
+    client.close_session()
+    yield server
+    server.release.set()
+    server.shutdown()
+    client.close_session()
+
+
+def test_deadline_sends_partial_notification(
+    newsletter, stalled_catalogue, monkeypatch, tmp_path
+):
+    from src import ledger
+
+    monkeypatch.setenv("LEDGER_PATH", str(tmp_path / "ledger.sqlite"))
+    monkeypatch.setenv("NEWSLETTER_DATE", "2024-01-17")
+    try:
+        start = time.monotonic()
+        result = CliRunner().invoke(newsletter.cli, ARGS)
+
+        assert time.monotonic() - start < RUN_DEADLINE
+        assert result.exit_code == 0, result.output
+        assert "Run deadline exceeded during the results phase" in result.output
+        method, path, body = stalled_catalogue.requests[-1]
+        assert (method, path) == ("POST", "/api/notifications")
+        notification = json.loads(body)
+        assert re.findall(r"Doc (\w+)", notification["body"]) == ["1"]
+        # the next run looks at the same window again, without document 1
+        sent = ledger.get_ledger()
+        assert sent.get_watermark("physics") is None
+        assert sent.get_sent_pids("physics", ["1", "2"]) == {"1"}
+    finally:
+        ledger.close_ledger()
+
+
+def test_deadline_fail_policy(newsletter, stalled_catalogue, monkeypatch):
+    monkeypatch.setenv("DEADLINE_POLICY", "fail")
+
+    result = CliRunner().invoke(newsletter.cli, ARGS)
+
+    assert result.exit_code == 1
+    assert "Run deadline exceeded during the results phase" in result.output
+    assert all(method == "GET" for method, _, _ in stalled_catalogue.requests)
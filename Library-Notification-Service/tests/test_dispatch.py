@@ -0,0 +1,75 @@
+import json
+
+from src import dispatch
+
+
+class Sleeps(list):
+    def __call__(self, seconds):
+        self.append(seconds)
+
+
+def test_dispatch_retries_transient_errors(fake_http):
+    attempts = {}
+
+    def handler(request):
+        target = json.loads(request.body)["targetGroups"][0]["groupIdentifier"]
+        attempts[target] = attempts.get(target, 0) + 1
+        if target == "busy" and attempts[target] == 1:
+            return 429, {}
+        if target == "flaky" and attempts[target] < 3:
+            return 503, {}
+        if target == "invalid":
+            return 400, {"message": "unknown group"}
+        return 200, {}
+
+    fake_http(handler)
+    sleeps = Sleeps()
+    notifications = [(target, "body") for target in ("ok", "busy", "flaky", "invalid")]
+
+    results = dispatch.dispatch_notifications(
+        notifications, rate_limit=0, max_retries=3, sleep=sleeps
+    )
+
+    assert [result["target"] for result in results] == [
+        "ok",
+        "busy",
+        "flaky",
+        "invalid",
+    ]
+    assert [result["sent"] for result in results] == [True, True, True, False]
+    assert [result["attempts"] for result in results] == [1, 2, 3, 1]
+    assert results[3]["status_code"] == 400
+    assert sorted(sleeps) == [1.0, 1.0, 2.0]
+
+
+def test_send_with_retries_honours_retry_after(monkeypatch):
+    responses = iter(
+        [
+            type(
+                "Response",
+                (),
+                {"status_code": 503, "text": "", "headers": {"Retry-After": "7"}},
+            ),
+            type("Response", (), {"status_code": 200, "text": "", "headers": {}}),
+        ]
+    )
+    monkeypatch.setattr(dispatch, "send_channel_request", lambda *args: next(responses))
+    sleeps = Sleeps()
+
+    result = dispatch.send_with_retries(
+        "body", "target", dispatch.RateLimiter(0), sleep=sleeps
+    )
+
+    assert result["sent"] and result["attempts"] == 2
+    assert sleeps == [7.0]
+
+
+def test_rate_limiter_spaces_calls():
+    now = [0.0]
+    sleeps = Sleeps()
+    rate_limiter = dispatch.RateLimiter(4, clock=lambda: now[0])
+
+    for _ in range(3):
+        rate_limiter.wait(sleeps)
+
+    assert sleeps == [0.25, 0.5]
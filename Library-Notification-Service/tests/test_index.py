@@ -0,0 +1,127 @@
+import re
+import urllib.parse
+from datetime import date
+
+import pytest
+from click.testing import CliRunner
+
+
+def get_doc(pid, title, subjects, restricted=False):
+    metadata = {
+        "title": title,
+        "subjects": [{"value": value, "scheme": scheme} for value, scheme in subjects],
+    }
+    if restricted:
+        metadata["restricted"] = True
+    return {"id": pid, "created": f"2024-01-0{pid}", "metadata": metadata}
+
+
+@pytest.fixture
+def index(updated_env, monkeypatch, tmp_path):
+    from src import index
+
+    monkeypatch.setenv("INDEX_PATH", str(tmp_path / "index.sqlite"))
+    monkeypatch.setenv("NEWSLETTER_DATE", "2024-01-17")
+    yield index
+    index.close_index()
+
+
+def test_index_queries_subjects_locally(index):
+    documents = index.get_index()
+    documents.upsert(
+        [
+            get_doc("1", "Physics", [("539.1", "UDC"), ("QC", "LOC")]),
+            get_doc("2", "Computing", [("004.4", "UDC")]),
+            get_doc("3", "Restricted", [("539.2", "UDC")], restricted=True),
+            get_doc("4", "Older", [("539.3", None)]),
+        ]
+    )
+    documents.add(date(2024, 1, 8), ["1", "2", "3"])
+    documents.add(date(2024, 1, 1), ["4"])
+
+    def get_pids(subjects, start=date(2024, 1, 8), end=date(2024, 1, 14)):
+        return [doc["id"] for doc in documents.iter_documents(subjects, start, end)]
+
+    assert get_pids(["539*:"]) == ["1"]
+    assert get_pids(["539*:", "004.4:UDC"]) == ["1", "2"]
+    # the scheme of any subject of the document, like the catalogue
+    assert get_pids(["QC:UDC"]) == ["1"]
+    assert get_pids(["539*:LOC", "004*:LOC"]) == ["1"]
+    assert get_pids(["539*:"], start=date(2024, 1, 1)) == ["1", "4"]
+
+    # re-indexing replaces the subjects
+    documents.upsert([get_doc("2", "Computing", [("539.4", "UDC")])])
+    assert get_pids(["004*:"]) == []
+    assert list(
+        documents.iter_documents(["539.4:"], date(2024, 1, 8), date(2024, 1, 8))
+    ) == [get_doc("2", "Computing", [("539.4", "UDC")])]
+
+
+def test_index_syncs_only_the_delta(index, fake_http, monkeypatch):
+    from src.env import settings
+
+    monkeypatch.setenv("INDEX_INITIAL_DAYS", "2")
+    backoffice = {"2024-01-15": ["1"], "2024-01-16": ["2"], "2024-01-17": ["1"]}
+    titles = {"1": "Physics", "2": "Computing", "9": "Updated"}
+
+    def handler(request):
+        url = urllib.parse.unquote(request.url)
+        if "/api/items/" in url:
+            day = re.search(r"_created:\[(\S+) TO", url).group(1)
+            hits = [{"metadata": {"document_pid": pid}} for pid in backoffice[day]]
+            return 200, {"hits": {"hits": hits, "total": len(hits)}, "links": {}}
+        if "/api/literature/" in url:
+            if "_updated" in url:
+                pids = ["9"] if "2024-01-15" in url else ["1"]
+            else:
+                pids = re.findall(r"pid: (\w+)", url)
+            hits = [get_doc(pid, titles[pid], [("539.1", "UDC")]) for pid in pids]
+            return 200, {"hits": {"hits": hits, "total": len(hits)}, "links": {}}
+        return 200, {"hits": {"hits": [], "total": 0}, "links": {}}
+
+    adapter = fake_http(handler)
+    documents = index.get_index()
+    assert index.sync_index(documents) == 3
+    assert documents.get_watermark() == date(2024, 1, 16)
+    assert index.sync_index(documents) == 0
+
+    # next day, document 1 got updated and a new item
+    adapter.requests.clear()
+    titles["1"] = "Physics, 2nd edition"
+    monkeypatch.setenv("NEWSLETTER_DATE", "2024-01-18")
+    settings.reset()
+    assert index.sync_index(documents) == 1
+    lookups = [r.url for r in adapter.requests if "pid%3A" in r.url]
+    assert lookups == []
+    docs = list(
+        documents.iter_documents(["539*:"], date(2024, 1, 17), date(2024, 1, 17))
+    )
+    assert [doc["metadata"]["title"] for doc in docs] == ["Physics, 2nd edition"]
+
+
+def test_preview_from_index(index, newsletter):
+    documents = index.get_index()
+    documents.upsert([get_doc("1", "Physics", [("539.1", "UDC")])])
+    documents.add(date(2024, 1, 9), ["1"])
+
+    result = CliRunner().invoke(
+        newsletter.preview,
+        ["--subjects", "53*:", "--title", "Physics", "--no-sync"],
+    )
+    assert result.exit_code == 0, result.output
+    assert "Results: 1 results." in result.output
+    assert "Physics</a></li>" in result.output
+
+    result = CliRunner().invoke(
+        newsletter.preview,
+        [
+            "--subjects",
+            "53*:",
+            "--title",
+            "Physics",
+            "--no-sync",
+            "--since",
+            "2024-01-10",
+        ],
+    )
+    assert "No results visible in the catalogue!" in result.output
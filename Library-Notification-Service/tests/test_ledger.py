@@ -0,0 +1,86 @@
+import json
+import re
+import urllib.parse
+from datetime import date
+
+import pytest
+from click.testing import CliRunner
+
+ARGS = ["--subjects", "53*:", "--title", "Physics", "--target", "physics"]
+
+
+@pytest.fixture
+def ledger(updated_env, monkeypatch, tmp_path):
+    from src import ledger
+
+    monkeypatch.setenv("LEDGER_PATH", str(tmp_path / "ledger.sqlite"))
+    monkeypatch.setenv("NEWSLETTER_DATE", "2024-01-17")
+    yield ledger
+    ledger.close_ledger()
+
+
+def test_ledger_window_starts_after_watermark(ledger, monkeypatch):
+    from src.env import settings
+
+    sent = ledger.get_ledger()
+    # last week of 2024-01-17
+    assert sent.get_window(["physics"]) == (date(2024, 1, 8), date(2024, 1, 14))
+
+    sent.record("physics", date(2024, 1, 14), ["1", "2"], "digest")
+    start, end = sent.get_window(["physics"])
+    assert start > end
+    assert sent.get_sent_pids("physics", ["1", "3"]) == {"1"}
+    assert sent.get_digest("physics") == "digest"
+
+    # a missed week is caught up, up to LEDGER_MAX_LOOKBACK_DAYS
+    monkeypatch.setenv("NEWSLETTER_DATE", "2024-01-31")
+    settings.reset()
+    assert sent.get_window(["physics"]) == (date(2024, 1, 15), date(2024, 1, 28))
+    assert sent.get_window(["physics", "math"])[0] == date(2024, 1, 15)
+    monkeypatch.setenv("LEDGER_MAX_LOOKBACK_DAYS", "7")
+    settings.reset()
+    assert sent.get_window(["physics"]) == (date(2024, 1, 22), date(2024, 1, 28))
+
+
+def test_newsletter_sends_only_new_documents(ledger, newsletter, fake_http):
+    from src.env import settings
+
+    backoffice_pids = {"items": ["1", "2"], "eitems": ["3"]}
+
+    def handler(request):
+        url = urllib.parse.unquote(request.url)
+        if "/api/items/" in url or "/api/eitems/" in url:
+            pids = backoffice_pids["items" if "/api/items/" in url else "eitems"]
+            hits = [{"metadata": {"document_pid": pid}} for pid in pids]
+            return 200, {"hits": {"hits": hits, "total": len(hits)}, "links": {}}
+        if "/api/literature/" in url:
+            pids = re.findall(r"pid: (\w+)", url)
+            hits = [{"id": pid, "metadata": {"title": f"Doc {pid}"}} for pid in pids]
+            return 200, {"hits": {"hits": hits, "total": len(hits)}}
+        return 200, {}
+
+    adapter = fake_http(handler)
+    result = CliRunner().invoke(newsletter.cli, ARGS)
+    assert "Results: 3 results." in result.output
+    backoffice_query = urllib.parse.unquote(adapter.requests[0].url)
+    assert "_created:[2024-01-08 TO 2024-01-14]" in backoffice_query
+
+    # rerun in the same week
+    adapter.requests.clear()
+    result = CliRunner().invoke(newsletter.cli, ARGS)
+    assert "Nothing new since the last notifications!" in result.output
+    assert adapter.requests == []
+
+    # next week, documents 1 and 3 got new items
+    settings.reset()
+    backoffice_pids.update(items=["1", "4"], eitems=["3"])
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("NEWSLETTER_DATE", "2024-01-24")
+        settings.reset()
+        result = CliRunner().invoke(newsletter.cli, ARGS)
+
+    assert "Results: 1 results." in result.output
+    notification = json.loads(adapter.requests[-1].body)
+    assert re.findall(r"Doc (\w+)", notification["body"]) == ["4"]
+    backoffice_query = urllib.parse.unquote(adapter.requests[0].url)
+    assert "_created:[2024-01-15 TO 2024-01-21]" in backoffice_query
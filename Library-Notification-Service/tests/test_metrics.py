@@ -0,0 +1,81 @@
+import json
+
+import click
+import pytest
+from click.testing import CliRunner
+from src import metrics
+
+
+@pytest.fixture
+def run_metrics(monkeypatch):
+    clock = iter(range(100))
+    recorded = metrics.Metrics(clock=lambda: next(clock))
+    monkeypatch.setattr(metrics, "_metrics", recorded)
+    return recorded
+
+
+def test_timed_stage_counts_generator_results(run_metrics):
+    @metrics.timed_stage("results")
+    def iter_docs():
+        metrics.increment("pages", "results")
+        yield from ["a", "b", "c"]
+
+    assert list(iter_docs()) == ["a", "b", "c"]
+
+    stage = run_metrics.to_dict()["stages"]["results"]
+    assert stage["calls"] == 1
+    assert stage["results"] == 3
+    assert stage["pages"] == 1
+    assert stage["duration_seconds"] == 1
+
+
+def test_record_run_writes_metrics_of_failed_run(run_metrics, tmp_path):
+    @click.command()
+    @click.option("--metrics-prometheus")
+    @click.option("--metrics-json")
+    @metrics.record_run
+    def command():
+        metrics.increment("requests", "backoffice", 2)
+        raise click.ClickException("failed")
+
+    prometheus, summary = tmp_path / "lns.prom", tmp_path / "lns.json"
+    result = CliRunner().invoke(
+        command,
+        ["--metrics-prometheus", str(prometheus), "--metrics-json", str(summary)],
+    )
+
+    assert result.exit_code == 1
+    assert 'lns_stage_requests{stage="backoffice"} 2\n' in prometheus.read_text()
+    assert "lns_run_success 0\n" in prometheus.read_text()
+    run = json.loads(summary.read_text())
+    assert run["run"]["success"] == 0
+    assert run["stages"]["backoffice"]["requests"] == 2
+
+
+def test_newsletter_records_stage_metrics(newsletter, fake_http, tmp_path):
+    def handler(request):
+        if "/api/items/" in request.url or "/api/eitems/" in request.url:
+            hits = [{"metadata": {"document_pid": "1"}}]
+            return 200, {"hits": {"hits": hits, "total": 1}, "links": {}}
+        if "/api/literature/" in request.url:
+            hits = [{"id": "1", "metadata": {"title": "Doc 1"}}]
+            return 200, {"hits": {"hits": hits, "total": 1}}
+        return 200, {}
+
+    fake_http(handler)
+    summary = tmp_path / "metrics.json"
+    result = CliRunner().invoke(
+        newsletter.cli,
+        ["--subjects", "53*:", "--title", "Physics", "--target", "physics"]
+        + ["--metrics-json", str(summary)],
+    )
+
+    assert result.exit_code == 0, result.output
+    stages = json.loads(summary.read_text())["stages"]
+    assert stages["backoffice"]["requests"] == stages["backoffice"]["pages"] == 2
+    assert stages["backoffice"]["results"] == 2
+    assert stages["results"]["requests"] == 1
+    assert stages["results"]["results"] == 1
+    assert stages["render"]["results"] == 1
+    assert stages["send"]["requests"] == stages["send"]["results"] == 1
+    assert stages["send"]["request_bytes"] > 0
@@ -1,4 +1,10 @@
+import json
+import re
 import subprocess
+import sys
+import urllib.parse
+
+from click.testing import CliRunner
 
 
 def test_newsletter_cli(monkeypatch):
@@ -7,4 +13,156 @@ def test_newsletter_cli(monkeypatch):
     )
 
     # Check the return code to see if the command ran successfully
+    assert result.returncode == 2
+
+
+def test_newsletter_help_without_env():
+    result = subprocess.run(
+        [sys.executable, "-m", "src.cli", "newsletter", "--help"],
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert "--subjects" in result.stdout
+
+
+def test_newsletter_reports_missing_env():
+    result = subprocess.run(
+        [sys.executable, "-m", "src.cli", "newsletter", "--subjects", "53*:"]
+        + ["--title", "Physics", "--target", "physics"],
+        capture_output=True,
+        text=True,
+        env={"PATH": ""},
+    )
+
     assert result.returncode == 1
+    assert "Missing environment variable:" in result.stderr
+    assert "Traceback" not in result.stderr
+
+
+def test_cli_cold_start_skips_http_stack():
+    code = (
+        "import sys, time; start = time.perf_counter(); import src.cli; "
+        "print(time.perf_counter() - start); "
+        "print(sorted({'requests', 'urllib3', 'sqlite3'} & set(sys.modules)))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+
+    elapsed, loaded = result.stdout.splitlines()
+    assert loaded == "[]"
+    assert float(elapsed) < 1.0
+
+
+def test_newsletter_batch_fetches_catalogue_once(newsletter, monkeypatch, tmp_path):
+    from src import api, dispatch
+
+    calls = {"backoffice": 0, "catalogue": [], "sent": {}}
+
+    def iter_backoffice_latest_pids(window=None):
+        calls["backoffice"] += 1
+        yield from ["1", "2", "3"]
+
+    def iter_results_from_pids(pids, subjects):
+        calls["catalogue"].append(subjects)
+        subjects_by_pid = {"1": "539.1", "2": "51-7", "3": "004.4"}
+        for pid in pids:
+            subject = {"value": subjects_by_pid[pid], "scheme": "UDC"}
+            yield {"id": pid, "metadata": {"title": pid, "subjects": [subject]}}
+
+    def send_channel_request(message, target):
+        calls["sent"][target] = message.count("<li>")
+        return type("Response", (), {"status_code": 200, "text": ""})
+
+    monkeypatch.setattr(api, "iter_backoffice_latest_pids", iter_backoffice_latest_pids)
+    monkeypatch.setattr(api, "iter_results_from_pids", iter_results_from_pids)
+    monkeypatch.setattr(dispatch, "send_channel_request", send_channel_request)
+
+    config = tmp_path / "newsletters.json"
+    config.write_text(
+        json.dumps(
+            {
+                "newsletters": [
+                    {"subjects": ["53*:"], "title": "Physics", "target": "physics"},
+                    {"subjects": ["51*:"], "title": "Maths", "target": "math"},
+                    {
+                        "subjects": ["53*:", "51*:UDC"],
+                        "title": "Science",
+                        "target": "science",
+                    },
+                    {"subjects": ["62*:"], "title": "Engineering", "target": "eng"},
+                ]
+            }
+        )
+    )
+    summary = tmp_path / "summary.json"
+    result = CliRunner().invoke(
+        newsletter.batch, ["--config", str(config), "--summary", str(summary)]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert json.loads(summary.read_text())["sent"] == 3
+    assert calls["backoffice"] == 1
+    assert calls["catalogue"] == [["53*:", "51*:", "51*:UDC", "62*:"]]
+    assert calls["sent"] == {"physics": 1, "math": 1, "science": 2}
+
+
+def test_newsletter_streams_backoffice_to_notification(newsletter, fake_http):
+    def handler(request):
+        url = urllib.parse.unquote(request.url)
+        if "/api/items/" in url or "/api/eitems/" in url:
+            pids = ["1", "2"] if "/api/items/" in url else ["3"]
+            hits = [{"metadata": {"document_pid": pid}} for pid in pids]
+            return 200, {"hits": {"hits": hits, "total": len(hits)}, "links": {}}
+        if "/api/literature/" in url:
+            pids = re.findall(r"pid: (\w+)", url)
+            hits = [{"id": pid, "metadata": {"title": f"Doc {pid}"}} for pid in pids]
+            return 200, {"hits": {"hits": hits, "total": len(hits)}}
+        return 200, {}
+
+    adapter = fake_http(handler)
+    result = CliRunner().invoke(
+        newsletter.cli,
+        ["--subjects", "53*:", "--title", "Physics", "--target", "physics"],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "Results: 3 results." in result.output
+    notification = json.loads(adapter.requests[-1].body)
+    assert notification["targetGroups"] == [{"groupIdentifier": "physics"}]
+    assert notification["body"].count("<li>") == 3
+
+
+def test_render_newsletter_links_the_remaining_pids(newsletter, monkeypatch):
+    from src.env import settings
+
+    monkeypatch.setenv("MAX_NOTIFICATION_RESULTS_COUNT", "2")
+    settings.reset()
+    docs = [{"id": pid, "metadata": {"title": f"Doc {pid}"}} for pid in "1234"]
+
+    message = newsletter.render_newsletter(docs, ["53*:"], "Physics", sort="title")
+
+    more_url = re.search(r"\.\.\.and <a href='([^']+)'>2 more</a>", message).group(1)
+    assert urllib.parse.unquote(more_url).endswith("(pid: 3 OR pid: 4)")
+
+    # too many to fit in a url, the subject search instead
+    monkeypatch.setenv("CATALOGUE_MAX_URL_BYTES", "50")
+    settings.reset()
+    message = newsletter.render_newsletter(docs, ["53*:"], "Physics", sort="title")
+
+    assert "...and 2 more, see <a href=" in message
+    assert "_updated" in urllib.parse.unquote(message)
+
+
+def test_newsletter_batch_rejects_invalid_subjects(newsletter, tmp_path):
+    config = tmp_path / "newsletters.json"
+    for subjects in ["53*:", [], ["53*"], ["53*:UDC:x"], [53]]:
+        newsletters = [{"subjects": subjects, "title": "Physics", "target": "physics"}]
+        config.write_text(json.dumps({"newsletters": newsletters}))
+
+        result = CliRunner().invoke(newsletter.batch, ["--config", str(config)])
+
+        assert result.exit_code == 1
+        assert "Newsletter physics subjects must be a non-empty list" in result.output
@@ -0,0 +1,70 @@
+import json
+import re
+import urllib.parse
+
+from click.testing import CliRunner
+
+ARGS = ["--subjects", "53*:", "--title", "Physics", "--target", "physics"]
+
+
+def catalogue_handler(request):
+    url = urllib.parse.unquote(request.url)
+    if "/api/items/" in url or "/api/eitems/" in url:
+        pids = ["1", "2"] if "/api/items/" in url else ["3"]
+        hits = [{"metadata": {"document_pid": pid}} for pid in pids]
+        return 200, {"hits": {"hits": hits, "total": len(hits)}, "links": {}}
+    if "/api/literature/" in url:
+        pids = re.findall(r"pid: (\w+)", url)
+        hits = [{"id": pid, "metadata": {"title": f"Doc {pid}"}} for pid in pids]
+        return 200, {"hits": {"hits": hits, "total": len(hits)}}
+    return 200, {}
+
+
+def unreachable_handler(request):
+    raise AssertionError(f"Unexpected request to {request.url}")
+
+
+def test_newsletter_replays_recorded_week(newsletter, fake_http, monkeypatch, tmp_path):
+    from src import ledger
+    from src.env import settings
+
+    recording = tmp_path / "week"
+    monkeypatch.setenv("NEWSLETTER_DATE", "2024-01-17")
+    adapter = fake_http(catalogue_handler)
+    result = CliRunner().invoke(newsletter.cli, ARGS + ["--record", str(recording)])
+    assert result.exit_code == 0, result.output
+
+    exchanges = (recording / "exchanges.jsonl").read_text()
+    assert len(exchanges.splitlines()) == len(adapter.requests) == 4
+    assert "backoffice-token" not in exchanges
+    assert json.loads((recording / "manifest.json").read_text())["date"] == "2024-01-17"
+
+    # replay on another day, without the network
+    monkeypatch.delenv("NEWSLETTER_DATE")
+    monkeypatch.setenv("LEDGER_PATH", str(tmp_path / "ledger.sqlite"))
+    settings.reset()
+    replay_adapter = fake_http(unreachable_handler)
+    try:
+        result = CliRunner().invoke(newsletter.cli, ARGS + ["--replay", str(recording)])
+        assert ledger.get_ledger() is None
+    finally:
+        ledger.close_ledger()
+
+    assert result.exit_code == 0, result.output
+    assert "Results: 3 results." in result.output
+    assert "Notification sent successfully to physics!" in result.output
+    assert replay_adapter.requests == []
+    assert not (tmp_path / "ledger.sqlite").exists()
+
+
+def test_replay_fails_on_unrecorded_request(newsletter, fake_http, tmp_path):
+    recording = tmp_path / "empty"
+    recording.mkdir()
+    (recording / "exchanges.jsonl").write_text("")
+    (recording / "manifest.json").write_text(json.dumps({"date": "2024-01-17"}))
+    fake_http(unreachable_handler)
+
+    result = CliRunner().invoke(newsletter.cli, ARGS + ["--replay", str(recording)])
+
+    assert result.exit_code != 0
+    assert "No recorded response for GET" in str(result.exception)
@@ -0,0 +1,88 @@
+import json
+import threading
+import urllib.request
+from datetime import datetime
+
+import pytest
+from src import scheduler
+
+
+@pytest.mark.parametrize(
+    "expression, moment, expected",
+    [
+        ("0 8 * * 1", datetime(2024, 1, 15, 8, 0), datetime(2024, 1, 22, 8, 0)),
+        ("0 8 * * 1", datetime(2024, 1, 14, 23, 59), datetime(2024, 1, 15, 8, 0)),
+        ("*/15 * * * *", datetime(2024, 1, 15, 8, 7, 30), datetime(2024, 1, 15, 8, 15)),
+        ("30 6 1 * *", datetime(2024, 1, 15), datetime(2024, 2, 1, 6, 30)),
+        ("0 0 29 2 *", datetime(2024, 3, 1), datetime(2028, 2, 29, 0, 0)),
+        # day or weekday when both are restricted, 7 is sunday
+        ("0 9 1 * 7", datetime(2024, 1, 2), datetime(2024, 1, 7, 9, 0)),
+    ],
+)
+def test_cron_schedule_next_after(expression, moment, expected):
+    assert scheduler.CronSchedule(expression).next_after(moment) == expected
+
+
+@pytest.mark.parametrize("expression", ["0 8 * *", "60 * * * *", "a * * * *"])
+def test_cron_schedule_rejects_invalid_expression(expression):
+    with pytest.raises(scheduler.ScheduleError):
+        scheduler.CronSchedule(expression)
+
+
+def test_scheduler_runs_due_jobs_together():
+    newsletters = [
+        {"target": "physics", "schedule": "0 8 * * 1"},
+        {"target": "math", "schedule": "0  8 * * 1"},
+        {"target": "it"},
+    ]
+    jobs = scheduler.get_jobs(newsletters, "0 9 * * 1")
+    now = [datetime(2024, 1, 15, 7, 0)]
+    runs, release = [], threading.Event()
+
+    def run_job(due):
+        runs.append([newsletter["target"] for newsletter in due])
+        release.wait(5)
+        return ["math"]
+
+    jobs_scheduler = scheduler.Scheduler(jobs, run_job, 2, clock=lambda: now[0])
+    assert [job.name for job in jobs] == ["0 8 * * 1", "0 9 * * 1"]
+    assert jobs_scheduler.run_pending() == []
+
+    now[0] = datetime(2024, 1, 15, 9, 0)
+    assert jobs_scheduler.run_pending() == jobs
+    # still running when due again
+    now[0] = datetime(2024, 1, 22, 9, 0)
+    assert jobs_scheduler.run_pending() == []
+    release.set()
+    jobs_scheduler.stop()
+    jobs_scheduler.serve_forever()
+
+    assert runs == [["physics", "math", "it"]]
+    status = {job["schedule"]: job for job in jobs_scheduler.status()["jobs"]}
+    assert status["0 8 * * 1"]["failures"] == 1
+    assert status["0 8 * * 1"]["last_error"] == "Notification failed for: math"
+    assert status["0 9 * * 1"]["last_success"] == "2024-01-15T09:00:00"
+    assert status["0 9 * * 1"]["next_run"] == "2024-01-29T09:00:00"
+
+
+def test_status_server_serves_health_and_metrics():
+    jobs = scheduler.get_jobs([{"target": "physics"}], "0 8 * * 1")
+    jobs_scheduler = scheduler.Scheduler(jobs, lambda due: [])
+    server = scheduler.start_status_server(jobs_scheduler, "127.0.0.1", 0)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{url}/health") as response:
+            health = json.load(response)
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            metrics = response.read().decode()
+    finally:
+        server.shutdown()
+        jobs_scheduler.stop()
+        jobs_scheduler.serve_forever()
+
+    assert health["status"] == "ok"
+    assert health["jobs"][0]["targets"] == ["physics"]
+    assert 'lns_scheduler_job_runs{schedule="0 8 * * 1"} 0' in metrics
+    assert "# TYPE lns_stage_requests_total counter" in metrics
+    # the run metrics of the one-shot commands mean nothing across runs
+    assert "lns_run_" not in metrics
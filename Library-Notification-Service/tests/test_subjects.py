@@ -0,0 +1,84 @@
+import random
+import re
+from fnmatch import fnmatchcase
+
+from src import subjects
+
+
+def server_filter_matches(query: str, document: dict) -> bool:
+    """Evaluate a `get_subject_query` query string like the catalogue index.
+
+    The query ORs `subjects.value:<pattern>` clauses, each optionally ANDed
+    with `subjects.scheme:<scheme>`, on the subjects flattened into
+    `subjects.value` and `subjects.scheme` keyword fields.
+    """
+    values = [s["value"] for s in document["metadata"]["subjects"]]
+    schemes = [s["scheme"] for s in document["metadata"]["subjects"]]
+    clauses = re.findall(
+        r"subjects\.value:([^\s)]+)(?: AND subjects\.scheme:([^\s)]+))?", query
+    )
+    assert clauses, query
+    return any(
+        any(fnmatchcase(value, pattern) for value in values)
+        and (not scheme or scheme in schemes)
+        for pattern, scheme in clauses
+    )
+
+
+def make_document(values):
+    return {
+        "metadata": {
+            "subjects": [{"value": value, "scheme": scheme} for value, scheme in values]
+        }
+    }
+
+
+def test_subject_matcher_routes_to_every_matching_filter():
+    matcher = subjects.SubjectMatcher(
+        {
+            "it": ["004*:", "005*:DEWEY"],
+            "management": ["65*:", "005*:UDC"],
+            "physics": ["53*:"],
+            "exact": ["53:"],
+        }
+    )
+
+    assert matcher.match(make_document([("005.1", "UDC")])) == {"management"}
+    assert matcher.match(make_document([("005.1", "DEWEY")])) == {"it"}
+    # flattened like the index: the scheme can come from another subject
+    assert matcher.match(make_document([("005.1", "UDC"), ("530", "DEWEY")])) == {
+        "it",
+        "management",
+        "physics",
+    }
+    assert matcher.match(make_document([("53", "UDC")])) == {"physics", "exact"}
+    assert matcher.match(make_document([("620", "UDC")])) == set()
+    assert matcher.match({"metadata": {}}) == set()
+
+
+def test_subject_matcher_is_equivalent_to_server_filter():
+    from src.utils import get_subject_query
+
+    rng = random.Random(9)
+    values = ["004.4", "005", "005.1", "05", "51-7", "519.2", "53", "539.1", "65.01"]
+    schemes = ["UDC", "DEWEY", "LOC"]
+    patterns = ["00*", "004*", "005*", "005", "5*", "51*", "53", "53*", "539.?", "6*"]
+    filters = {
+        index: [
+            f"{rng.choice(patterns)}:{rng.choice(schemes + [''])}"
+            for _ in range(rng.randint(1, 3))
+        ]
+        for index in range(30)
+    }
+    matcher = subjects.SubjectMatcher(filters)
+
+    for _ in range(500):
+        document = make_document(
+            (rng.choice(values), rng.choice(schemes)) for _ in range(rng.randint(0, 3))
+        )
+        expected = {
+            key
+            for key, filter_subjects in filters.items()
+            if server_filter_matches(get_subject_query(filter_subjects), document)
+        }
+        assert matcher.match(document) == expected
@@ -0,0 +1,52 @@
+from src import utils
+
+
+def test_iter_unique_keeps_first_occurrences():
+    assert list(utils.iter_unique(iter(["3", "1", "3", "2", "1"]))) == ["3", "1", "2"]
+
+
+def test_create_channel_message_from_iterator(updated_env):
+    docs = utils.CountingIterator(
+        {"id": pid, "metadata": {"title": f"Title {pid}"}} for pid in ("1", "2")
+    )
+
+    message = utils.create_channel_message(docs, "Physics")
+
+    assert docs.count == 2
+    assert message.startswith("<h4>Latest books/e-books for Physics</h4>")
+    assert "pid%3A%201'>Title 1</a>" in message
+    assert "pid%3A%202'>Title 2</a>" in message
+
+
+def test_select_top_results_keeps_newest():
+    docs = (
+        {"id": str(day), "created": f"2024-01-{day:02d}T10:00:00"}
+        for day in (3, 9, 1, 7, 5)
+    )
+
+    top_results, total = utils.select_top_results(docs, 3)
+
+    assert [doc["id"] for doc in top_results] == ["9", "7", "5"]
+    assert total == 5
+
+
+def test_select_top_results_by_title():
+    docs = [{"id": title, "metadata": {"title": title}} for title in "dCaBe"]
+
+    top_results, total = utils.select_top_results(docs, 2, sort="title")
+
+    assert [doc["id"] for doc in top_results] == ["a", "B"]
+    assert total == 5
+
+
+def test_create_channel_message_links_remaining_results(updated_env):
+    docs = [{"id": "1", "metadata": {"title": "Title 1"}}]
+
+    message = utils.create_channel_message(docs, "Physics", 4, "https://more")
+
+    assert message.count("<li>") == 1
+    assert message.endswith("</ul>\n<p>...and <a href='https://more'>4 more</a></p>")
+    assert "more" not in utils.create_channel_message(docs, "Physics")
+
+    message = utils.create_channel_message(docs, "Physics", 4, "https://more", "all")
+    assert message.endswith("<p>...and 4 more, see <a href='https://more'>all</a></p>")
@@ -1,12 +1,20 @@
 import datetime
+import hashlib
+import json
 import os
+import queue
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
 
 import backoff
 import requests
 import structlog
-from models import Base, Categories, Journals, Publications
-from sqlalchemy import create_engine
+import urllib3
+from models import Base, Categories, Journals, Publications, ReportStates
+from requests.adapters import HTTPAdapter
+from sqlalchemy import and_, create_engine, delete, exists, inspect
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 PUBLICATIONS = "https://cds.cern.ch/tools/custom_query_summary.py?start={year}&end={year}&apikey={cds_token}&refresh=1&repeated_values=0"
@@ -14,6 +22,15 @@ SUBJECTS = PUBLICATIONS + "&otag=65017a"
 
 LOGGING = structlog.get_logger("Annual_Report_API")
 
+FIRST_YEAR = 2004
+REPORTS = ("subjects", "publications")
+
+# errors retried, the streamed body raises the urllib3 ones while parsed
+RETRIED_ERRORS = (requests.exceptions.RequestException, urllib3.exceptions.HTTPError)
+
+# seconds a blocked fetcher waits before checking whether the run stopped
+QUEUE_POLL_SECONDS = 0.1
+
 
 def _backoff_handler(details):
     LOGGING.info(
@@ -55,6 +72,78 @@ ONLY_CERN_SUBJECTS = [
 ]
 
 
+def iter_report_lines(source, attributes=None):
+    """
+    Parse a CDS report while it is read from `source`.
+
+    Parameters
+    ----------
+    source : file-like
+        The XML report, e.g. the raw stream of the response.
+    attributes : dict
+        When given, updated with the attributes of the yearly report.
+
+    Yields
+    ------
+    tuple
+        The (name, count) of every line of the report. The lines are freed
+        once parsed, so the memory used does not grow with the report.
+    """
+    parent = None
+    for event, element in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if element.tag == "yearly_report":
+                parent = element
+                if attributes is not None:
+                    attributes.update(element.attrib)
+            elif parent is None:
+                parent = element
+            continue
+        if element.tag == "line":
+            yield element.findtext("result"), element.findtext("nb")
+            element.clear()
+            parent.remove(element)
+
+
+def upsert(session, model, rows, index_elements):
+    """INSERT the `rows` of `model`, updating the ones conflicting on the
+    unique `index_elements`, in one statement.
+    """
+    if not rows:
+        return
+    statement = insert(model).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={
+            name: statement.excluded[name]
+            for name in rows[0]
+            if name not in index_elements
+        },
+    )
+    session.execute(statement)
+
+
+def delete_duplicates(connection, table, columns):
+    """DELETE the rows of `table` duplicating the `columns` of a row with a
+    higher id, so that a unique index can be created on them.
+    """
+    newer = table.alias("newer")
+    connection.execute(
+        delete(table).where(
+            exists().where(
+                and_(
+                    *(newer.c[column.name] == column for column in columns),
+                    newer.c.id > table.c.id,
+                )
+            )
+        )
+    )
+
+
+def get_digest(result):
+    return hashlib.sha256(json.dumps(result, sort_keys=True).encode()).hexdigest()
+
+
 class AnnualReportsAPI:
     def __init__(
         self,
@@ -65,6 +154,10 @@ class AnnualReportsAPI:
         db_port: str = "",
         years: list = None,
         cds_token: str = "",
+        max_workers: int = 0,
+        lookback: int = None,
+        full: bool = False,
+        batch_size: int = 8,
     ) -> None:
         self.db_user = db_user or os.environ.get("DB_USER")
         self.db_password = db_password or os.environ.get("DB_PASSWORD")
@@ -83,45 +176,96 @@ class AnnualReportsAPI:
             ]
         ):
             raise ValueError("All the required attributes must be passed!")
+        # full: every year fetched and written, unchanged or not
+        self.full = full
+        # years before the current one still fetched by an incremental run
+        if lookback is None:
+            lookback = int(os.environ.get("ANNUAL_REPORTS_LOOKBACK", 1))
         self.years = years
         if not self.years:
             current_year = datetime.datetime.now().year
-            self.years = list(range(2004, current_year + 1))
+            first_year = (
+                FIRST_YEAR if full else max(current_year - lookback, FIRST_YEAR)
+            )
+            self.years = list(range(first_year, current_year + 1))
+        # (report, year): hash and validators of the last report written
+        self.report_states = {}
+        # (report, year): validators of the responses of this run
+        self.validators = {}
+        # CDS requests sent at the same time, at most
+        self.max_workers = max_workers or int(os.environ.get("CDS_MAX_WORKERS", 4))
+        # reports written per transaction, at most
+        self.batch_size = batch_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         database_url = f"postgresql://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"  # noqa: E501
         self.engine = create_engine(database_url)
 
     def create_tables(self):
         Base.metadata.create_all(self.engine, checkfirst=True)
+        # the unique indexes the upserts rely on, for tables created before them,
+        # keeping the last written of the duplicate rows
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                existing = {
+                    index["name"]
+                    for index in inspect(connection).get_indexes(table.name)
+                }
+                for index in table.indexes:
+                    if index.name in existing:
+                        continue
+                    if index.unique:
+                        delete_duplicates(connection, table, index.columns)
+                    index.create(connection)
 
     def drop_tables(self):
         Base.metadata.drop_all(self.engine, checkfirst=True)
 
-    @backoff.on_exception(
-        backoff.expo,
-        requests.exceptions.RequestException,
-        max_tries=5,
-        on_backoff=_backoff_handler,
-    )
+    def request_report_from_cds(self, report, year, url):
+        """
+        Get a CDS report, conditional on the validators of the last one.
+
+        Returns
+        -------
+        requests.Response
+            The response, its body not read yet, None when CDS answers the
+            report did not change (304).
+        """
+        headers = {}
+        state = self.report_states.get((report, year), {})
+        if not self.full and state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if not self.full and state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+        response = self.session.get(url, headers=headers, stream=True)
+        if response.status_code == 304 or not response.ok:
+            response.close()
+        response.raise_for_status()
+        if response.status_code == 304:
+            return None
+        self.validators[report, year] = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        response.raw.decode_content = True
+        return response
+
     def request_publications_from_cds(self, year):
         url = PUBLICATIONS.format(year=year, cds_token=self.cds_token)
-        response = requests.get(url)
-        response.raise_for_status()
-        root = ET.fromstring(response.content)
-        return root
+        return self.request_report_from_cds("publications", year, url)
+
+    def request_subjects_from_cds(self, year):
+        url = SUBJECTS.format(year=year, cds_token=self.cds_token)
+        return self.request_report_from_cds("subjects", year, url)
 
     @backoff.on_exception(
         backoff.expo,
-        requests.exceptions.RequestException,
+        RETRIED_ERRORS,
         max_tries=5,
         on_backoff=_backoff_handler,
     )
-    def request_subjects_from_cds(self, year):
-        url = SUBJECTS.format(year=year, cds_token=self.cds_token)
-        response = requests.get(url)
-        response.raise_for_status()
-        root = ET.fromstring(response.content)
-        return root
-
     def get_publications_by_year(self, year):
         """
         Get the number of publications for a given year.
@@ -133,90 +277,247 @@ class AnnualReportsAPI:
 
         Returns
         -------
-        int
-            The number of publications for the given year.
+        tuple
+            The publication counts and the journals of the given year, None
+            when unchanged since the last run.
+
+        The download is retried, from the start, until the report is parsed.
         """
-        root = self.request_publications_from_cds(year)
-        yearly_report = root.find("yearly_report")
-        publication_report_count = yearly_report.attrib
-        del publication_report_count["year"]
+        response = self.request_publications_from_cds(year)
+        if response is None:
+            return None
+        publication_report_count = {}
         journals = {}
-        for journal in yearly_report.findall("line"):
-            name = journal.find("result").text
-            if "TOTAL" in name:
-                continue
-            journals[name] = journal.find("nb").text
+        with response:
+            for name, count in iter_report_lines(
+                response.raw, publication_report_count
+            ):
+                if "TOTAL" in name:
+                    continue
+                journals[name] = count
+        del publication_report_count["year"]
         return publication_report_count, journals
 
+    @backoff.on_exception(
+        backoff.expo,
+        RETRIED_ERRORS,
+        max_tries=5,
+        on_backoff=_backoff_handler,
+    )
     def get_subjects_by_year(self, year):
-        root = self.request_subjects_from_cds(year)
-        yearly_report = root.find("yearly_report")
+        response = self.request_subjects_from_cds(year)
+        if response is None:
+            return None
         subjects = {}
-        for subject in yearly_report.findall("line"):
-            name = subject.find("result").text
-            if "TOTAL" in name or name not in ONLY_CERN_SUBJECTS:
-                continue
-            subjects[name] = subject.find("nb").text
+        with response:
+            for name, count in iter_report_lines(response.raw):
+                if "TOTAL" in name or name not in ONLY_CERN_SUBJECTS:
+                    continue
+                subjects[name] = count
         return subjects
 
-    def get_subjects(self):
-        for year in self.years:
-            year = int(year)
-            LOGGING.info("Getting categories", year=year)
-            results = self.get_subjects_by_year(year)
-            year_to_date = datetime.date(year, 1, 1)
-            with Session(self.engine) as session:
+    def fetch_report(self, index, report, year, reports_queue, stop):
+        """
+        Fetch a report and put (index, report) on `reports_queue`.
+
+        The report put is a (report, year, result) tuple, None when the
+        fetch failed (logged) or the report is unchanged. Blocks while the
+        queue is full, until the run stops.
+        """
+        if stop.is_set():
+            return
+        fetchers = {
+            "subjects": self.get_subjects_by_year,
+            "publications": self.get_publications_by_year,
+        }
+        item = None
+        try:
+            result = fetchers[report](year)
+            state = self.report_states.get((report, year), {})
+            if result is None or (
+                not self.full and state.get("hash") == get_digest(result)
+            ):
+                LOGGING.info("Report unchanged, not written", report=report, year=year)
+            else:
+                item = (report, year, result)
+        except Exception:
+            LOGGING.exception("Fetching report failed", report=report, year=year)
+        finally:
+            # the writer waits for every index, whatever happened
+            while not stop.is_set():
                 try:
-                    LOGGING.info("Deleting categories", year=year)
-                    session.query(Categories).filter_by(year=year_to_date).delete()
-                    records = [
-                        Categories(year=year_to_date, category=key, count=int(value))
-                        for key, value in results.items()
-                    ]
-                    LOGGING.info(
-                        "Populate categories", count=len(records), categories=results
-                    )
-                    session.add_all(records)
-                    session.commit()
-                except Exception as e:
-                    print("ERROR: " + str(e))
-                    LOGGING.exception("Populate categories")
-                else:
-                    LOGGING.info("Populate categories success")
+                    reports_queue.put((index, item), timeout=QUEUE_POLL_SECONDS)
+                    break
+                except queue.Full:
+                    continue
 
-    def get_publications(self):
-        for year in self.years:
-            year = int(year)
-            LOGGING.info("Getting publications", year=year)
-            publications, journals = self.get_publications_by_year(year)
-            year_to_date = datetime.date(year, 1, 1)
-            with Session(self.engine) as session:
+    def write_subjects(self, session, year, subjects):
+        year_to_date = datetime.date(year, 1, 1)
+        LOGGING.info("Populate categories", count=len(subjects), categories=subjects)
+        upsert(
+            session,
+            Categories,
+            [
+                {"year": year_to_date, "category": key, "count": int(value)}
+                for key, value in subjects.items()
+            ],
+            ["year", "category"],
+        )
+        session.query(Categories).filter(
+            Categories.year == year_to_date, Categories.category.not_in(subjects)
+        ).delete(synchronize_session=False)
+
+    def write_publications(self, session, year, publications, journals):
+        year_to_date = datetime.date(year, 1, 1)
+        LOGGING.info("Populate publications", publications=publications)
+        upsert(
+            session,
+            Publications,
+            [
+                {
+                    "year": year_to_date,
+                    **{key: int(value) for key, value in publications.items()},
+                }
+            ],
+            ["year"],
+        )
+        LOGGING.info("Populate journals", count=len(journals), journals=journals)
+        upsert(
+            session,
+            Journals,
+            [
+                {"year": year_to_date, "journal": key, "count": int(value)}
+                for key, value in journals.items()
+            ],
+            ["year", "journal"],
+        )
+        session.query(Journals).filter(
+            Journals.year == year_to_date, Journals.journal.not_in(journals)
+        ).delete(synchronize_session=False)
+
+    def load_report_states(self):
+        with Session(self.engine) as session:
+            self.report_states = {
+                (state.report, state.year.year): {
+                    "hash": state.hash,
+                    "etag": state.etag,
+                    "last_modified": state.last_modified,
+                }
+                for state in session.query(ReportStates).all()
+            }
+
+    def save_report_state(self, session, report, year, digest):
+        validators = self.validators.get((report, year), {})
+        upsert(
+            session,
+            ReportStates,
+            [
+                {
+                    "report": report,
+                    "year": datetime.date(year, 1, 1),
+                    "hash": digest,
+                    "etag": validators.get("etag"),
+                    "last_modified": validators.get("last_modified"),
+                    "updated": datetime.datetime.now(),
+                }
+            ],
+            ["report", "year"],
+        )
+
+    def write_reports(self, reports):
+        """
+        Write the (report, year, result) reports in one transaction.
+
+        Each report is written in a savepoint: one failing is rolled back and
+        logged, the others are committed. Readers never see a year half
+        written.
+        """
+        writers = {
+            "subjects": self.write_subjects,
+            "publications": lambda session, year, result: self.write_publications(
+                session, year, *result
+            ),
+        }
+        with Session(self.engine) as session, session.begin():
+            for report, year, result in reports:
                 try:
-                    LOGGING.info("Deleting publications", year=year)
-                    session.query(Publications).filter_by(year=year_to_date).delete()
-                    LOGGING.info("Populate publications", publications=publications)
-                    records = Publications(year=year_to_date, **publications)
-                    session.add(records)
-                    session.commit()
-                except Exception as e:
-                    print("ERROR: " + str(e))
-                    LOGGING.exception("Populate publications")
+                    with session.begin_nested():
+                        writers[report](session, year, result)
+                        self.save_report_state(
+                            session, report, year, get_digest(result)
+                        )
+                except Exception:
+                    LOGGING.exception("Writing report failed", report=report, year=year)
                 else:
-                    LOGGING.info("Populate publications success")
-            with Session(self.engine) as session:
-                try:
-                    LOGGING.info("Deleting journals", year=year)
-                    session.query(Journals).filter_by(year=year_to_date).delete()
-                    records = [
-                        Journals(year=year_to_date, journal=key, count=int(value))
-                        for key, value in journals.items()
-                    ]
-                    LOGGING.info(
-                        "Populate journals", count=len(records), journals=journals
+                    LOGGING.info("Writing report success", report=report, year=year)
+
+    def get_years(self):
+        return sorted(int(year) for year in self.years)
+
+    def update_reports(self, reports):
+        """
+        Fetch the reports of every year at the same time and write the
+        changed ones while the others are still being fetched.
+
+        The fetchers put the reports on a bounded queue, drained by the
+        calling thread alone in batches of at most `batch_size` reports, one
+        transaction each, in the order of the years. A report is only
+        fetched once the ones more than a queue size before it are written,
+        so the reports held out of order stay bounded too. A report failing
+        to fetch or to write is logged and skipped, the others are written.
+        Only an error of the transaction itself, like the database going
+        away, stops the fetchers and is raised.
+
+        A report is not written again when CDS answers it did not change, or
+        when its content hash is the one of the last report written, unless
+        `full` is set.
+
+        Parameters
+        ----------
+        reports : list
+            The report types to update, from `REPORTS`.
+        """
+        years = self.get_years()
+        LOGGING.info("Getting reports", reports=reports, years=years, full=self.full)
+        self.load_report_states()
+        tasks = [(report, year) for year in years for report in reports]
+        # fetched reports waiting for the writer, and tasks submitted ahead of it
+        window = 2 * self.max_workers
+        reports_queue = queue.Queue(maxsize=window)
+        stop = Event()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            # write the reports in the order of the tasks, as they arrive
+            arrived, next_index, submitted, batch = {}, 0, 0, []
+            while next_index < len(tasks):
+                while submitted < min(next_index + window, len(tasks)):
+                    report, year = tasks[submitted]
+                    executor.submit(
+                        self.fetch_report, submitted, report, year, reports_queue, stop
                     )
-                    session.add_all(records)
-                    session.commit()
-                except Exception as e:  # noqa: F841
-                    LOGGING.exception("Populate journals")
-                else:
-                    LOGGING.info("Populate journals success")
+                    submitted += 1
+                index, item = reports_queue.get()
+                arrived[index] = item
+                while next_index in arrived:
+                    item = arrived.pop(next_index)
+                    next_index += 1
+                    if item is not None:
+                        batch.append(item)
+                if len(batch) >= self.batch_size or (batch and reports_queue.empty()):
+                    self.write_reports(batch)
+                    batch = []
+            if batch:
+                self.write_reports(batch)
+        finally:
+            # on a write error, the fetchers still running give up
+            stop.set()
+            executor.shutdown(wait=True)
+
+    def get_subjects(self):
+        self.update_reports(["subjects"])
+
+    def get_publications(self):
+        self.update_reports(["publications"])
+
+    def get_reports(self):
+        self.update_reports(REPORTS)
@@ -4,17 +4,49 @@ from api import AnnualReportsAPI
 
 @click.command()
 @click.option("--years", "-y", multiple=True, default=[])
-def fetch_annual_reports(years):
-    annual_reports = AnnualReportsAPI(years=years)
+@click.option(
+    "--max-workers",
+    "-w",
+    type=click.IntRange(min=1),
+    envvar="CDS_MAX_WORKERS",
+    default=4,
+    show_default=True,
+    help="CDS reports fetched at the same time.",
+)
+@click.option(
+    "--lookback",
+    type=click.IntRange(min=0),
+    envvar="ANNUAL_REPORTS_LOOKBACK",
+    default=1,
+    show_default=True,
+    help="Past years fetched again with the current one, without --years.",
+)
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Fetch every year since 2004 and write them all, changed or not.",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="Reports written per transaction, at most.",
+)
+def fetch_annual_reports(years, max_workers, lookback, full, batch_size):
+    annual_reports = AnnualReportsAPI(
+        years=years,
+        max_workers=max_workers,
+        lookback=lookback,
+        full=full,
+        batch_size=batch_size,
+    )
 
     click.echo("Create tables if missing")
     annual_reports.create_tables()
 
-    click.echo("Fetching subjects")
-    annual_reports.get_subjects()
-
-    click.echo("Fetching publications")
-    annual_reports.get_publications()
+    click.echo("Fetching subjects and publications")
+    annual_reports.get_reports()
 
     click.echo("Done")
 
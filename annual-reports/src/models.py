@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Date, Integer, String
+from sqlalchemy import Column, Date, DateTime, Index, Integer, String
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -6,6 +6,7 @@ Base = declarative_base()
 
 class Publications(Base):
     __tablename__ = "annual_reports_publications"
+    __table_args__ = (Index("annual_reports_publications_year", "year", unique=True),)
 
     id = Column(Integer, primary_key=True)
     publications = Column(Integer, nullable=False)
@@ -18,6 +19,11 @@ class Publications(Base):
 
 class Categories(Base):
     __tablename__ = "annual_reports_categories"
+    __table_args__ = (
+        Index(
+            "annual_reports_categories_year_category", "year", "category", unique=True
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     category = Column(String, nullable=False)
@@ -27,8 +33,26 @@ class Categories(Base):
 
 class Journals(Base):
     __tablename__ = "annual_reports_journals"
+    __table_args__ = (
+        Index("annual_reports_journals_year_journal", "year", "journal", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     journal = Column(String, nullable=False)
     count = Column(Integer, nullable=False)
     year = Column(Date, nullable=False)
+
+
+class ReportStates(Base):
+    __tablename__ = "annual_reports_states"
+    __table_args__ = (
+        Index("annual_reports_states_report_year", "report", "year", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    report = Column(String, nullable=False)
+    hash = Column(String, nullable=False)
+    etag = Column(String)
+    last_modified = Column(String)
+    updated = Column(DateTime, nullable=False)
+    year = Column(Date, nullable=False)
@@ -1,11 +1,34 @@
 import datetime
+import io
+import time
 
+import api
 import pytest
-from api import AnnualReportsAPI
+import requests
+import urllib3
+from api import AnnualReportsAPI, iter_report_lines
 from models import Categories, Journals, Publications
 from sqlalchemy.orm import Session
 
 
+def test_iter_report_lines():
+    report = io.BytesIO(
+        b'<?xml version="1.0" encoding="UTF-8"?>'
+        b'<customquerysummary tag="773__p">'
+        b'<yearly_report year="2022" publications="3" rest="0">'
+        b"<line><nb>3</nb><result>TOTAL</result></line>"
+        b"<line><nb>2</nb><link>http://cds.cern.ch/</link><result>JHEP</result></line>"
+        b"<line><nb>1</nb><result>Nature</result></line>"
+        b"</yearly_report></customquerysummary>"
+    )
+    attributes = {}
+    lines = iter_report_lines(report, attributes)
+
+    assert next(lines) == ("TOTAL", "3")
+    assert attributes == {"year": "2022", "publications": "3", "rest": "0"}
+    assert list(lines) == [("JHEP", "2"), ("Nature", "1")]
+
+
 class TestAPI:
     def setup_class(self):
         self.annual_reports = AnnualReportsAPI(
@@ -77,6 +100,175 @@ class TestAPI:
                 assert category.count == expected[category.category]
                 assert category.year == datetime.date(2022, 1, 1)
 
+    @pytest.mark.vcr()
+    def test_reports(self):
+        self.annual_reports.get_reports()
+
+        with Session(self.annual_reports.engine) as session:
+            assert session.query(Publications).count() == 1
+            assert session.query(Categories).count() == 23
+            assert session.query(Journals).count() == 193
+
+    def test_interrupted_report_is_downloaded_again(self, monkeypatch):
+        class ResetReport(io.BytesIO):
+            def read(self, *args):
+                raise urllib3.exceptions.ProtocolError("Connection reset by peer")
+
+        report = (
+            b'<?xml version="1.0" encoding="UTF-8"?><customquerysummary>'
+            b'<yearly_report year="2022">'
+            b"<line><nb>8</nb><result>Engineering</result></line>"
+            b"</yearly_report></customquerysummary>"
+        )
+        bodies = [ResetReport(), io.BytesIO(report)]
+
+        def get(url, headers, stream):
+            response = requests.Response()
+            response.status_code = 200
+            response.raw = bodies.pop(0)
+            return response
+
+        monkeypatch.setattr(self.annual_reports.session, "get", get)
+        assert self.annual_reports.get_subjects_by_year(2022) == {"Engineering": "8"}
+        assert bodies == []
+
+    def test_reports_failed_year_is_isolated(self, monkeypatch):
+        def get_subjects_by_year(year):
+            if year == 2021:
+                raise ValueError("Invalid report")
+            return {"Engineering": str(year - 2000)}
+
+        monkeypatch.setattr(self.annual_reports, "years", [2022, 2021, 2023])
+        monkeypatch.setattr(
+            self.annual_reports, "get_subjects_by_year", get_subjects_by_year
+        )
+        self.annual_reports.get_subjects()
+
+        with Session(self.annual_reports.engine) as session:
+            categories = session.query(Categories).order_by(Categories.id).all()
+            assert [(c.year.year, c.count) for c in categories] == [
+                (2022, 22),
+                (2023, 23),
+            ]
+
+    def test_unchanged_reports_are_not_written(self, monkeypatch):
+        monkeypatch.setattr(
+            self.annual_reports,
+            "get_subjects_by_year",
+            lambda year: {"Engineering": "8"},
+        )
+        self.annual_reports.get_subjects()
+        with Session(self.annual_reports.engine) as session:
+            session.query(Categories).update({"count": 0})
+            session.commit()
+
+        self.annual_reports.get_subjects()
+        with Session(self.annual_reports.engine) as session:
+            assert session.query(Categories).one().count == 0
+
+        monkeypatch.setattr(self.annual_reports, "full", True)
+        self.annual_reports.get_subjects()
+        with Session(self.annual_reports.engine) as session:
+            assert session.query(Categories).one().count == 8
+
+    def test_reports_are_upserted(self, monkeypatch):
+        subjects = {"Engineering": "8", "Condensed Matter": "6"}
+        monkeypatch.setattr(
+            self.annual_reports, "get_subjects_by_year", lambda year: subjects
+        )
+        self.annual_reports.get_subjects()
+
+        subjects = {"Engineering": "9"}
+        self.annual_reports.get_subjects()
+        with Session(self.annual_reports.engine) as session:
+            categories = session.query(Categories).all()
+            assert [(c.category, c.count) for c in categories] == [("Engineering", 9)]
+
+    def test_unexpected_fetch_error_skips_the_year(self, monkeypatch):
+        written = []
+
+        def get_digest(result):
+            if result["Engineering"] == "5":
+                raise ValueError("Unexpected report")
+            return ""
+
+        def write_reports(reports):
+            written.extend(year for _, year, _ in reports)
+
+        monkeypatch.setattr(api, "get_digest", get_digest)
+        monkeypatch.setattr(self.annual_reports, "years", [2004, 2005, 2006])
+        monkeypatch.setattr(
+            self.annual_reports,
+            "get_subjects_by_year",
+            lambda year: {"Engineering": str(year - 2000)},
+        )
+        monkeypatch.setattr(self.annual_reports, "write_reports", write_reports)
+        self.annual_reports.get_subjects()
+
+        assert written == [2004, 2006]
+
+    def test_write_error_stops_the_fetchers(self, monkeypatch):
+        fetched = []
+
+        def get_subjects_by_year(year):
+            fetched.append(year)
+            return {"Engineering": str(year - 2000)}
+
+        def write_reports(reports):
+            raise RuntimeError("Database unavailable")
+
+        monkeypatch.setattr(self.annual_reports, "years", list(range(2004, 2024)))
+        monkeypatch.setattr(self.annual_reports, "max_workers", 1)
+        monkeypatch.setattr(
+            self.annual_reports, "get_subjects_by_year", get_subjects_by_year
+        )
+        monkeypatch.setattr(self.annual_reports, "write_reports", write_reports)
+        with pytest.raises(RuntimeError, match="Database unavailable"):
+            self.annual_reports.get_subjects()
+        assert len(fetched) < 20
+
+    def test_fetches_wait_for_a_slow_year(self, monkeypatch):
+        fetched, written = [], []
+
+        def get_subjects_by_year(year):
+            if year == 2004:
+                # without a window, all the other years would be fetched meanwhile
+                time.sleep(0.5)
+            fetched.append(year)
+            return {"Engineering": str(year - 2000)}
+
+        def write_reports(reports):
+            written.extend(year for _, year, _ in reports)
+
+        monkeypatch.setattr(self.annual_reports, "years", list(range(2004, 2024)))
+        monkeypatch.setattr(self.annual_reports, "max_workers", 2)
+        monkeypatch.setattr(
+            self.annual_reports, "get_subjects_by_year", get_subjects_by_year
+        )
+        monkeypatch.setattr(self.annual_reports, "write_reports", write_reports)
+        self.annual_reports.get_subjects()
+
+        assert written == list(range(2004, 2024))
+        assert fetched.index(2004) < 2 * 2
+
+    def test_create_tables_deletes_duplicates(self):
+        index = next(iter(Categories.__table__.indexes))
+        index.drop(self.annual_reports.engine)
+        year = datetime.date(2022, 1, 1)
+        with Session(self.annual_reports.engine) as session:
+            session.add_all(
+                [
+                    Categories(category="Engineering", count=count, year=year)
+                    for count in (7, 8)
+                ]
+            )
+            session.commit()
+
+        self.annual_reports.create_tables()
+        with Session(self.annual_reports.engine) as session:
+            categories = session.query(Categories).all()
+            assert [(c.category, c.count) for c in categories] == [("Engineering", 8)]
+
     @pytest.mark.vcr()
     def test_journals(self):
         self.annual_reports.get_publications()